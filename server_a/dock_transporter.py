@@ -1,11 +1,15 @@
+import atexit
 import configparser
+import json
 import logging
 import os
+import queue
 import signal
 import subprocess
 import sys
 import time
-from datetime import datetime
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 import requests
 
@@ -21,11 +25,34 @@ config = configparser.ConfigParser()
 config.read(CONFIG_FILE)
 
 # ========== Configuração de logs ========== #
-logging.basicConfig(
-    filename="/var/log/dock_transporter.log", # Diretório padrão para logs dos sistemas GNU/Linux
-    level=logging.INFO, # Menor nível de log, fora DEBUG
-    format="%(asctime)s - %(message)s", # O formato das logs será (YYYY-MM-DD HH:MM:SS,mm - Mensagem da Log)
+class FormatoJSON(logging.Formatter):
+    """Formata cada registro como uma linha JSON (hora, nível, mensagem e, se houver, imagem)."""
+
+    def format(self, record):
+        registro = {
+            "hora": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "nivel": record.levelname,
+            "mensagem": record.getMessage(),
+        }
+        if getattr(record, "imagem", None):
+            registro["imagem"] = record.imagem
+        return json.dumps(registro, ensure_ascii=False)
+
+
+# O daemon apenas enfileira os registros; a escrita no arquivo (com rotação) acontece
+# na thread do QueueListener, iniciada em start_daemon() depois dos forks.
+fila_logs = queue.SimpleQueue()
+manipulador_fila = QueueHandler(fila_logs)
+manipulador_fila.setFormatter(logging.Formatter("%(message)s"))  # Apenas une a mensagem aos argumentos
+manipulador_arquivo = RotatingFileHandler(
+    "/var/log/dock_transporter.log", # Diretório padrão para logs dos sistemas GNU/Linux
+    maxBytes=config.getint("LOGS", "tamanho_max_mb", fallback=10) * 1024 * 1024,
+    backupCount=config.getint("LOGS", "arquivos_backup", fallback=5),
+    encoding="utf-8",
 )
+manipulador_arquivo.setFormatter(FormatoJSON())
+logging.basicConfig(level=logging.INFO, handlers=[manipulador_fila]) # Menor nível de log, fora DEBUG
+ouvinte_logs = QueueListener(fila_logs, manipulador_arquivo)
 
 
 # ================================================== #
@@ -67,21 +94,21 @@ def coletar() -> None:
 
     # Grava, no arquivo de log, o nome de cada imagem encontrada com numeração
     for index, image in enumerate(images, start=1):
-        logging.info(f"{index}) {image}")
+        logging.info("%d) %s", index, image, extra={"imagem": image})
         
     # Envia informações das imagens para o endpoint
     response = requests.post(url, json={"imagens": images})
-    logging.info(f"Enviando informações das imagens encontradas para {url}.")
+    logging.info("Enviando informações das imagens encontradas para %s.", url)
     
     # Verifica status da resposta e registra no arquivo de log sucesso ou erro
     if response.status_code == 200:
-        logging.info(f"Imagens analizadas com sucesso.")
+        logging.info("Imagens analizadas com sucesso.")
     else:
         logging.error(
-            f"Erro ao enviar imagens: {response.status_code}, {response.text}"
+            "Erro ao enviar imagens: %s, %s", response.status_code, response.text
         )
 
-    logging.info(f"Processo de coleta e envio de imagens finalizado.")
+    logging.info("Processo de coleta e envio de imagens finalizado.")
 
 
 def executar_coletar(signum, frame) -> None:
@@ -153,6 +180,10 @@ def start_daemon() -> None:
     if pid > 0:
         sys.exit(0)  # Filho sai, mantendo apenas o neto como daemon
 
+    # Threads não sobrevivem ao fork: a escrita dos logs só começa no processo do daemon
+    ouvinte_logs.start()
+    atexit.register(ouvinte_logs.stop) # Grava os registros ainda na fila ao encerrar
+
     # Grava o PID do daemon
     with open("/var/run/dock_transporter.pid", "w") as f:
         f.write(str(os.getpid()))
@@ -1,15 +1,31 @@
 import ast
+import asyncio
+import atexit
 import configparser
+import contextvars
 import json
 import logging
 import os
+import queue
 import re
 import subprocess
-from threading import Lock
-
+import tempfile
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from threading import BoundedSemaphore, Event, Lock, Thread
+
+import docker
 import openai
 import pymongo
+from bson import Binary, ObjectId
+from docker.utils import parse_repository_tag
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from nvdlib import searchCVE
 
 # ================================================== #
@@ -31,25 +47,278 @@ client = pymongo.MongoClient(
 )
 db = client["DockShield"]
 
+# Coleções auxiliares começam com "_" para não serem confundidas com as coleções das imagens
+INDICE_CVES = "_indice_cves"  # Índice invertido CVE -> imagens/digests/pacotes afetados
+BUSCA = "_busca"  # Índice de texto das descrições do NVD e dos relatórios da IA
+VARREDURAS = "_varreduras"  # Versão e data da última alteração de cada coleção de imagem
+CONSUMO = "_consumo"  # Tokens e custo da IA acumulados por varredura e por dia
+BASES = "_bases"  # Resumos de cenário das camadas base (SO + primeira camada), por modelo
+BASES_CVES = "_bases_cves"  # Detalhes do NVD e relatórios da IA das CVEs das camadas base
+SBOMS = "_sboms"  # SBOM (CycloneDX) e CVEs conhecidas de cada imagem, para a reavaliação
+
+
+# ========== Modo de Armazenamento ========== #
+# "completo" grava os dados do NVD e as respostas da IA como recebidos;
+# "compacto" mantém como campos simples apenas o que é consultado e comprime o restante.
+MODO_ARMAZENAMENTO = config.get("STORAGE", "modo", fallback="completo")
+
+# Campos do NVD desnecessários para a IA (e, no modo compacto, guardados comprimidos)
+CAMPOS_VOLUMOSOS_CVE = ("configurations", "references", "cpe")
+# Campos do NVD fora das consultas: comprimidos no modo compacto e, nas CVEs da camada base, não copiados
+CAMPOS_COMPRIMIDOS_CVE = CAMPOS_VOLUMOSOS_CVE + ("descriptions",)
+# Campos das respostas da IA mantidos como campos simples no modo compacto
+CAMPOS_SIMPLES_RESPOSTA_IA = ("id", "model", "created", "usage")
+# Imagens com a mesma camada base compartilham o resumo da base e os relatórios das suas CVEs
+DEDUPLICAR_CAMADA_BASE = config.getboolean("STORAGE", "deduplicar_camada_base", fallback=True)
+# Dias até os detalhes do NVD guardados para as CVEs das camadas base serem buscados de novo (0 = nunca)
+VALIDADE_DETALHES_BASE_DIAS = config.getfloat("STORAGE", "validade_detalhes_base_dias", fallback=7)
+
+
+# ========== Docker Engine ========== #
+DOCKER_SOCKET = config.get("DOCKER", "socket", fallback="unix:///var/run/docker.sock")
+# Downloads de imagens simultâneos; as imagens já baixadas são analisadas enquanto os demais continuam
+DOCKER_PULLS_SIMULTANEOS = config.getint("DOCKER", "pulls_simultaneos", fallback=3)
+
+
+# ========== Eventos De Progresso ========== #
+EVENTOS_MAX = config.getint("EVENTOS", "eventos_guardados", fallback=1000)  # Eventos mantidos para reconexões
+# Origem autorizada a ler o /eventos de outro site (CORS), normalmente a interface web. Sem valor, o
+# cabeçalho não é enviado e nenhum outro site lê os eventos; "*" libera qualquer origem.
+EVENTOS_ORIGEM = config.get("EVENTOS", "origem_permitida", fallback="").strip()
+
+
+# ========== Reavaliação Dos SBOMs ========== #
+# Intervalo entre as atualizações do banco do Trivy seguidas da reavaliação dos SBOMs (0 desativa)
+REAVALIACAO_SBOM_HORAS = config.getfloat("SBOM", "reavaliacao_horas", fallback=24)
+
 
 # ========== Configuração de logs ========== #
-logging.basicConfig(
-    filename="/var/log/dockshield.log", # Diretório padrão para logs dos sistemas GNU/Linux
-    level=logging.INFO,  # Menor nível de log, fora DEBUG
-    format="%(asctime)s - %(message)s",  # O formato das logs será (YYYY-MM-DD HH:MM:SS,mm - Mensagem da Log)
+ARQUIVO_LOG = "/var/log/dockshield.log"  # Diretório padrão para logs dos sistemas GNU/Linux
+LOG_TAMANHO_MAX_MB = config.getint("LOGS", "tamanho_max_mb", fallback=50)
+LOG_ARQUIVOS_BACKUP = config.getint("LOGS", "arquivos_backup", fallback=5)
+# Quantas vezes a mesma mensagem (ex: uma linha por CVE) pode ser registrada por minuto (0 = sem limite)
+LOG_LIMITE_REPETICOES = config.getint("LOGS", "limite_repeticoes_por_minuto", fallback=30)
+
+# Contexto da varredura incluído em cada registro. As threads dos backends recebem uma
+# cópia do contexto (ver `executar_nos_backends`), então cada uma mantém o seu.
+contexto_log = {
+    campo: contextvars.ContextVar(campo, default=None) for campo in ("varredura", "imagem", "etapa")
+}
+
+
+def definir_contexto_log(**campos):
+    """Define os campos de contexto (varredura, imagem, etapa) dos próximos registros de log."""
+    for campo, valor in campos.items():
+        contexto_log[campo].set(valor)
+
+
+class FiltroContexto(logging.Filter):
+    """Copia o contexto da varredura para o registro, ainda na thread que o gerou."""
+
+    def filter(self, record):
+        for campo, variavel in contexto_log.items():
+            setattr(record, campo, variavel.get())
+        return True
+
+
+class FiltroRepeticao(logging.Filter):
+    """Limita as repetições de uma mesma mensagem por minuto.
+
+    A mensagem é identificada pelo seu modelo (`record.msg`, antes da
+    substituição dos argumentos), por isso as linhas informativas usam o
+    estilo "%s" em vez de f-strings. Avisos e erros nunca são descartados. O
+    total descartado é informado no campo `suprimidos` do próximo registro
+    aceito com o mesmo modelo, se ele voltar a aparecer na janela seguinte.
+    Uma vez por janela, as contagens expiradas são removidas, para que a
+    memória não cresça com mensagens que não se repetem.
+    """
+
+    def __init__(self, limite: int, janela: float = 60.0):
+        super().__init__()
+        self.limite = limite
+        self.janela = janela
+        self.contagens = {}  # modelo -> [início da janela, aceitos, suprimidos]
+        self.ultima_limpeza = 0.0
+        self.trava = Lock()
+
+    def filter(self, record):
+        if not self.limite or record.levelno >= logging.WARNING:
+            return True
+        with self.trava:
+            if record.created - self.ultima_limpeza >= self.janela:
+                # Descarta as contagens sem uso há mais de duas janelas; a janela extra
+                # permite informar os suprimidos se a mensagem voltar logo depois
+                self.contagens = {
+                    modelo: contagem
+                    for modelo, contagem in self.contagens.items()
+                    if record.created - contagem[0] < 2 * self.janela
+                }
+                self.ultima_limpeza = record.created
+            contagem = self.contagens.setdefault(record.msg, [record.created, 0, 0])
+            if record.created - contagem[0] >= self.janela:
+                if contagem[2]:
+                    record.suprimidos = contagem[2]
+                contagem[:] = [record.created, 0, 0]
+            if contagem[1] >= self.limite:
+                contagem[2] += 1
+                return False
+            contagem[1] += 1
+            return True
+
+
+class FormatoJSON(logging.Formatter):
+    """Formata cada registro como uma linha JSON, com os campos de contexto da varredura."""
+
+    def format(self, record):
+        registro = {
+            "hora": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "nivel": record.levelname,
+            "mensagem": record.getMessage(),
+        }
+        for campo in (*contexto_log, "suprimidos"):
+            if getattr(record, campo, None) is not None:
+                registro[campo] = getattr(record, campo)
+        return json.dumps(registro, ensure_ascii=False, default=str)
+
+
+# As threads da aplicação apenas enfileiram os registros; a formatação e a escrita
+# no arquivo (com rotação) acontecem na thread do QueueListener.
+fila_logs = queue.SimpleQueue()
+manipulador_fila = QueueHandler(fila_logs)
+manipulador_fila.setFormatter(logging.Formatter("%(message)s"))  # Apenas une a mensagem aos argumentos
+manipulador_fila.addFilter(FiltroContexto())
+manipulador_fila.addFilter(FiltroRepeticao(LOG_LIMITE_REPETICOES))
+manipulador_arquivo = RotatingFileHandler(
+    ARQUIVO_LOG, maxBytes=LOG_TAMANHO_MAX_MB * 1024 * 1024, backupCount=LOG_ARQUIVOS_BACKUP, encoding="utf-8"
 )
+manipulador_arquivo.setFormatter(FormatoJSON())
+logging.basicConfig(level=logging.INFO, handlers=[manipulador_fila])  # Menor nível de log, fora DEBUG
+ouvinte_logs = QueueListener(fila_logs, manipulador_arquivo)
+ouvinte_logs.start()
+atexit.register(ouvinte_logs.stop)  # Grava os registros ainda na fila ao encerrar
 
 
 # ========== API Da LLM ========== #
-# Configura a chave de API e a url do ai_LLM com base no arquivo de configuração
-openai_client = openai.OpenAI(
-    api_key=config["AI"]["api_key"], base_url=config["AI"]["base_url"]
+def _criar_backend(nome: str | None, secao) -> dict:
+    """Cria um backend de IA (cliente OpenAI + modelos) a partir de uma seção do arquivo de configuração."""
+    return {
+        "nome": nome,
+        # Configura a chave de API e a url do ai_LLM com base no arquivo de configuração
+        "cliente": openai.OpenAI(api_key=secao["api_key"], base_url=secao["base_url"]),
+        "modelo": secao["model"],
+        # Modelo mais barato/rápido para CVEs de menor risco (vazio: usa o modelo principal)
+        "modelo_economico": secao.get(
+            "modelo_economico", config.get("ROTEAMENTO", "modelo_economico", fallback="")
+        ).strip(),
+    }
+
+
+# Seções [AI.<nome>] ativam a análise paralela com vários modelos, com os resultados
+# marcados pelo <nome>. Sem elas, apenas o modelo da seção [AI] é usado.
+BACKENDS_IA = [
+    _criar_backend(secao.removeprefix("AI."), config[secao])
+    for secao in config.sections()
+    if secao.startswith("AI.")
+]
+MULTIPLOS_MODELOS = bool(BACKENDS_IA)
+if not MULTIPLOS_MODELOS:
+    BACKENDS_IA = [_criar_backend(None, config["AI"])]
+
+
+# ========== Prompts ========== #
+PROMPT_ANALISE_CVE = (
+    "Você é um especialista em segurança da informação, "
+    "especializado em análise de vulnerabilidades e CVEs "
+    "para contêineres Docker executados na plataforma FIWARE. "
+    "Sua função é analisar relatórios de segurança, identificar "
+    "vulnerabilidades críticas, detalhar os riscos associados "
+    "a cada CVE e recomendar ações de mitigação. Ao responder, "
+    "forneça informações técnicas precisas, incluindo o impacto "
+    "no CID (Confidencialidade, Integridade, Disponibilidade), "
+    "possíveis vetores de ataque e correções sugeridas. Mantenha "
+    "a linguagem clara e objetiva, mas com a profundidade "
+    "necessária para orientar profissionais de cibersegurança. "
+    "Ao final de cada análise, gere um resumo executivo para "
+    "facilitar a compreensão do risco por gestores não técnicos. "
+    "Além disso, avalie o nível de criticidade de cada "
+    "vulnerabilidade com uma pontuação de 0 a 100, onde 0 "
+    "indica risco inexistente e 100 indica risco completamente "
+    "inaceitável. Proponha medidas de resolução que minimizem "
+    "o risco, priorizando alternativas que não exijam mudanças "
+    "de versão do sistema, mas sugira essa abordagem se for "
+    "a opção mais viável para mitigar a ameaça. O parâmetro "
+    "de entrada será um dicionário Python ou um arquivo json."
+)
+
+# Instruções adicionadas ao prompt de análise quando várias CVEs são enviadas juntas
+PROMPT_ANALISE_CVE_LOTE = (
+    "Nesta requisição você receberá uma lista JSON com várias CVEs. Analise cada "
+    "uma separadamente, seguindo todas as instruções acima, e responda apenas com "
+    'um objeto JSON no formato {"analises": [{"cve": "<ID da CVE>", "relatorio": '
+    '"<análise completa em Markdown>"}]}, com exatamente uma entrada por CVE recebida.'
 )
 
+# ========== Análise Em Lote ========== #
+# Orçamento aproximado de tokens de entrada por requisição em lote (0 desativa o modo em lote)
+LOTE_MAX_TOKENS = config.getint("AI", "lote_max_tokens", fallback=0)
+LOTE_MAX_CVES = config.getint("AI", "lote_max_cves", fallback=10)
+
+
+# ========== Roteamento E Custos ========== #
+def _lista_config(secao: str, opcao: str) -> list:
+    """Lê uma opção do arquivo de configuração como lista separada por vírgulas."""
+    valor = config.get(secao, opcao, fallback="")
+    return [item.strip().upper() for item in valor.split(",") if item.strip()]
+
+
+# Severidades enviadas ao modelo econômico e severidades que recebem um resumo sem IA
+SEVERIDADES_ECONOMICAS = _lista_config("ROTEAMENTO", "severidades_economicas")
+SEVERIDADES_SEM_IA = _lista_config("ROTEAMENTO", "severidades_sem_ia")
+# Destino das CVEs sem versão corrigida disponível: "normal", "economico" ou "sem_ia"
+ROTA_SEM_CORRECAO = config.get("ROTEAMENTO", "sem_correcao", fallback="normal").strip().lower()
+# Limite de tokens gastos pela IA em cada imagem (0 = sem limite)
+ORCAMENTO_TOKENS_IMAGEM = config.getint("ROTEAMENTO", "orcamento_tokens_imagem", fallback=0)
+
+# Preço, em dólares por milhão de tokens, de entrada e saída de cada modelo
+PRECOS_MODELOS = {
+    modelo: tuple(float(preco) for preco in valor.split(","))
+    for modelo, valor in (config["CUSTOS"].items() if "CUSTOS" in config else [])
+}
+
+# Ordem de prioridade das severidades: as mais graves são analisadas primeiro
+ORDEM_SEVERIDADES = {"CRITICAL": 0, "HIGH": 1, "MEDIUM": 2, "LOW": 3}
+
 
 # ========== Outros ========== #
 app = FastAPI()  # Cria a aplicação FastAPI
 lock = Lock()  # Cria uma trava para evitar problemas com threads
+# Execuções do Trivy que usam o banco de vulnerabilidades (varreduras, atualização do banco e
+# reavaliação dos SBOMs) disputam a trava do mesmo cache; a trava as executa uma de cada vez.
+trava_trivy = Lock()
+
+
+@app.on_event("startup")
+def criar_indices():
+    """Garante a existência dos índices usados nas consultas das coleções auxiliares.
+
+    A criação de índices no MongoDB é idempotente, então a função pode ser
+    executada a cada inicialização da API sem efeitos colaterais.
+    """
+    try:
+        db[INDICE_CVES].create_index("cve")
+        db[INDICE_CVES].create_index("pacotes.nome")
+        db[INDICE_CVES].create_index("colecao")
+        # O idioma "none" desativa stemming e stop words: os textos misturam
+        # descrições em inglês (NVD) e relatórios em português (IA).
+        db[BUSCA].create_index(
+            [("cve", pymongo.TEXT), ("descricao", pymongo.TEXT), ("relatorio", pymongo.TEXT)],
+            weights={"cve": 10, "descricao": 5, "relatorio": 1},
+            default_language="none",
+            name="busca_texto",
+        )
+        db[BUSCA].create_index([("colecao", pymongo.ASCENDING), ("severidade", pymongo.ASCENDING)])
+    except pymongo.errors.PyMongoError as e:
+        logging.error("Erro ao criar os índices das coleções auxiliares: %s", e)
 
 
 # ================================================== #
@@ -62,7 +331,9 @@ async def baixar_e_subir_imagens(request: Request):
     Esta função recebe uma lista de nomes de imagens Docker, baixa cada imagem,
     inicia um contêiner a partir dela e, em seguida, executa uma análise de
     segurança usando a ferramenta Trivy. Os relatórios são salvos temporariamente
-    e processados.
+    e processados. Os downloads são feitos pela API do Docker Engine, vários ao
+    mesmo tempo, enquanto as imagens já baixadas são analisadas uma de cada vez.
+    O progresso de cada imagem é publicado no endpoint `/eventos`.
 
     Args:
         request: O objeto Request do FastAPI contendo os dados da requisição.
@@ -74,48 +345,81 @@ async def baixar_e_subir_imagens(request: Request):
     """
     data = await request.json()
     images = data.get("imagens", [])
-    logging.info(f"Imagens recebidas: {data}")
+    logging.info("%d imagens recebidas para análise.", len(images))
 
+    # A análise roda em uma thread para não bloquear o loop de eventos (e o /eventos).
+    await run_in_threadpool(processar_imagens, images)
+
+    logging.info("Análise concluida com sucesso!")
+    return {"message": "Análise concluida com sucesso!"}
+
+
+def processar_imagens(images: list):
+    """Baixa, inicia e analisa uma lista de imagens, publicando o progresso de cada uma.
+
+    Args:
+        images: Os nomes das imagens Docker (ex: "mongo:4.4").
+    """
+    # Imagens repetidas na lista são baixadas e analisadas uma única vez.
+    images = list(dict.fromkeys(images))
     for image in images:
-        try:
-            # Baixa a imagem Docker para uso local.
-            subprocess.run(
-                ["docker", "pull", image], capture_output=True, text=True, check=True
-            )
-            logging.info(f"Imagem {image} baixada.")
+        publicar_evento("recebida", imagem=image)
 
-            # Inicia a imagem Docker em um contêiner separado.
-            subprocess.run(
-                ["docker", "run", "-d", image],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-            logging.info(f"Imagem {image} subida.")
+    # Inicia todos os downloads (limitados por DOCKER_PULLS_SIMULTANEOS); cada imagem é
+    # analisada assim que o seu download termina, na ordem de conclusão, enquanto os demais continuam.
+    with ThreadPoolExecutor(max_workers=DOCKER_PULLS_SIMULTANEOS) as executor:
+        downloads = {executor.submit(baixar_imagem, image): image for image in images}
 
-            # Configurações para o Trivy: diretório de saída e timeout.
-            output_dir = "/opt/dockshield/relatorios"
-            os.makedirs(output_dir, exist_ok=True)
-            os.environ["TRIVY_TIMEOUT"] = "600s"
+        for download in as_completed(downloads):
+            analisar_imagem(downloads[download], download)
 
-            # Cria um nome para o arquivo de relatório do trivy.
-            output_file = os.path.join(
-                output_dir, f'{image.replace(":", "_").replace("/", "_")}.json'
-            )
 
-            # Executa a análise de segurança das imagens com o Trivy e salva a saída.
-            with open(output_file, "w", encoding="utf-8") as f:
-                trivy_result = subprocess.run(
-                    ["trivy", "image", "--format", "json", image],
-                    stdout=f,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    check=False,
-                )
+def analisar_imagem(image: str, download: Future):
+    """Inicia e analisa com o Trivy uma imagem já baixada, publicando o progresso.
+
+    Args:
+        image: O nome da imagem Docker (ex: "mongo:4.4").
+        download: O Future do download da imagem, já concluído.
+    """
+    definir_contexto_log(imagem=image, varredura=None, etapa="download")
+    try:
+        # Obtém o resultado do download da imagem Docker (ou a exceção, se falhou).
+        imagem_docker = download.result()
+        logging.info("Imagem %s baixada (%s).", image, imagem_docker["digest"])
+        publicar_evento("baixada", digest=imagem_docker["digest"], tamanho=imagem_docker["tamanho"])
+
+        # Inicia a imagem Docker em um contêiner separado.
+        iniciar_conteiner(image)
+        logging.info("Imagem %s subida.", image)
+
+        # Diretório de saída dos relatórios do Trivy.
+        output_dir = "/opt/dockshield/relatorios"
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Executa a análise de segurança das imagens com o Trivy e salva a saída. Cada varredura
+        # usa um arquivo próprio, pois requisições simultâneas podem analisar a mesma imagem.
+        definir_contexto_log(etapa="trivy")
+        with trava_trivy, tempfile.NamedTemporaryFile(
+            "w",
+            dir=output_dir,
+            prefix=f'{image.replace(":", "_").replace("/", "_")}_',
+            suffix=".json",
+            delete=False,
+            encoding="utf-8",
+        ) as f:
+            output_file = f.name
+            trivy_result = subprocess.run(
+                # --list-all-pkgs inclui o inventário de pacotes usado para gerar o SBOM.
+                ["trivy", "image", "--format", "json", "--list-all-pkgs", "--timeout", "600s", image],
+                stdout=f,
+                stderr=subprocess.PIPE,
+                text=True,
+                check=False,
+            )
+        try:
             if trivy_result.returncode == 0:
                 logging.info(
-                    f"Análise Trivy concluída com sucesso para {image}. "
-                    f"Relatório salvo em {output_file}"
+                    "Análise Trivy concluída com sucesso para %s. Relatório salvo em %s", image, output_file
                 )
 
                 # Carrega o JSON do relatório Trivy diretamente após a geração.
@@ -125,27 +429,278 @@ async def baixar_e_subir_imagens(request: Request):
                 # Inicia a função rodar
                 rodar(trivy_data, output_file)
 
-                # Remove o arquivo de relatório temporário para economizar espaço.
-                os.remove(output_file)
+                # Guarda o inventário de pacotes da imagem para as reavaliações futuras.
+                definir_contexto_log(etapa="sbom")
+                guardar_sbom(trivy_data, output_file)
+
+                publicar_evento(
+                    "concluida",
+                    colecao=trivy_data["ArtifactName"].replace("/", "_").replace(":", "_"),
+                )
 
             else:
                 logging.error(
-                    f"Erro na análise do Trivy para {image}. "
-                    f"Código de retorno: {trivy_result.returncode}"
+                    "Erro na análise do Trivy para %s. Código de retorno: %s", image, trivy_result.returncode
                 )
-                logging.error(f"Mensagem de erro: {trivy_result.stderr}")
+                logging.error("Mensagem de erro: %s", trivy_result.stderr)
+                publicar_evento("erro", mensagem="Erro na análise do Trivy.")
+        finally:
+            # Remove o arquivo de relatório temporário para economizar espaço.
+            os.remove(output_file)
+
+    except docker.errors.DockerException as e:
+        logging.error("Erro do Docker Engine para imagem %s: %s", image, e)
+        publicar_evento("erro", mensagem=f"Erro do Docker Engine: {e}")
+    except Exception as e:
+        logging.error("Erro inesperado ao processar imagem %s: %s", image, e)
+        publicar_evento("erro", mensagem=f"Erro inesperado: {e}")
 
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Erro de comando Docker/Trivy para imagem {image}: {e}")
-            logging.error(f"Saída de erro: {e.stderr}")
-        except Exception as e:
-            logging.error(f"Erro inesperado ao processar imagem {image}: {e}")
 
-    logging.info("Análise concluida com sucesso!")
-    return {"message": "Análise concluida com sucesso!"}
+# ========== Docker Engine ========== #
+_cliente_docker = None
+trava_cliente_docker = Lock()
+semaforo_downloads = BoundedSemaphore(DOCKER_PULLS_SIMULTANEOS)
+downloads_em_andamento = {}  # Referência da imagem -> Future do download em andamento
+trava_downloads = Lock()
+
+
+def cliente_docker() -> docker.APIClient:
+    """Retorna o cliente da API do Docker Engine, conectado pelo socket configurado.
+
+    A conexão é criada no primeiro uso, e não ao importar o módulo, porque o
+    cliente consulta a versão da API do daemon ao ser criado.
+    """
+    global _cliente_docker
+    with trava_cliente_docker:
+        if _cliente_docker is None:
+            _cliente_docker = docker.APIClient(base_url=DOCKER_SOCKET)
+        return _cliente_docker
+
+
+def baixar_imagem(referencia: str) -> dict:
+    """Baixa uma imagem pela API do Docker Engine, compartilhando downloads simultâneos.
+
+    Pedidos simultâneos da mesma referência aguardam o mesmo download em vez de
+    iniciar outro. O número de downloads em paralelo é limitado por
+    `DOCKER_PULLS_SIMULTANEOS`.
+
+    Args:
+        referencia: A referência da imagem (ex: "mongo:4.4").
+
+    Returns:
+        O resultado de `_baixar_imagem`.
+
+    Raises:
+        docker.errors.DockerException: Se o download ou a inspeção falharem.
+    """
+    definir_contexto_log(imagem=referencia, varredura=None, etapa="download")
+    with trava_downloads:
+        futuro = downloads_em_andamento.get(referencia)
+        responsavel = futuro is None
+        if responsavel:
+            futuro = Future()
+            downloads_em_andamento[referencia] = futuro
+
+    if not responsavel:
+        logging.info("Download de %s já em andamento; aguardando o mesmo download.", referencia)
+        return futuro.result()
+
+    try:
+        with semaforo_downloads:
+            resultado = _baixar_imagem(referencia)
+        futuro.set_result(resultado)
+        return resultado
+    except BaseException as e:
+        futuro.set_exception(e)
+        raise
+    finally:
+        with trava_downloads:
+            downloads_em_andamento.pop(referencia, None)
+
+
+def _baixar_imagem(referencia: str) -> dict:
+    """Executa o download de uma imagem acompanhando o progresso e a inspeciona.
+
+    Args:
+        referencia: A referência da imagem (ex: "mongo:4.4").
+
+    Returns:
+        Um dicionário com o ID, o digest, as camadas (DiffIDs), o tamanho da
+        imagem e os bytes baixados.
+    """
+    cliente = cliente_docker()
+    repositorio, tag = parse_repository_tag(referencia)
+
+    # Cada evento do stream descreve o progresso de uma camada.
+    tamanhos_camadas = {}
+    for evento in cliente.pull(repositorio, tag or "latest", stream=True, decode=True):
+        if "error" in evento:
+            raise docker.errors.APIError(evento["error"])
+        camada = evento.get("id")
+        total = (evento.get("progressDetail") or {}).get("total")
+        if camada and total:
+            tamanhos_camadas[camada] = total
+        if camada and evento.get("status") in ("Pull complete", "Already exists"):
+            logging.info("Camada %s de %s: %s.", camada, referencia, evento["status"])
+
+    # Digests, camadas e tamanho da imagem em uma única consulta.
+    inspecao = cliente.inspect_image(referencia)
+    digests = inspecao.get("RepoDigests") or []
+    resultado = {
+        "id": inspecao["Id"],
+        "digest": digests[0] if digests else inspecao["Id"],
+        "camadas": (inspecao.get("RootFS") or {}).get("Layers") or [],
+        "tamanho": inspecao.get("Size"),
+        "baixado": sum(tamanhos_camadas.values()),
+    }
+    logging.info(
+        "Download de %s concluído: %d camadas, %.1f MB (%.1f MB baixados).",
+        referencia,
+        len(resultado["camadas"]),
+        (resultado["tamanho"] or 0) / 1024 / 1024,
+        resultado["baixado"] / 1024 / 1024,
+    )
+    return resultado
+
+
+def iniciar_conteiner(referencia: str) -> str:
+    """Cria e inicia um contêiner a partir da imagem, como `docker run -d`.
+
+    Args:
+        referencia: A referência da imagem (ex: "mongo:4.4").
+
+    Returns:
+        O ID do contêiner criado.
+    """
+    cliente = cliente_docker()
+    conteiner = cliente.create_container(referencia)
+    cliente.start(conteiner["Id"])
+    return conteiner["Id"]
+
+
+# ========== Eventos De Progresso ========== #
+class BarramentoEventos:
+    """Guarda em memória os eventos de progresso mais recentes e acorda quem os aguarda.
+
+    Cada evento recebe um ID crescente, usado como `id` no Server-Sent Events,
+    para que clientes reconectados (cabeçalho Last-Event-ID) recebam apenas o
+    que perderam. Os eventos são publicados pelas threads das análises e
+    aguardados no loop de eventos: cada conexão se inscreve com um
+    `asyncio.Event`, sinalizado com `call_soon_threadsafe`, e não ocupa uma
+    thread enquanto espera.
+    """
+
+    def __init__(self, tamanho: int):
+        self.eventos = deque(maxlen=tamanho)
+        self.proximo_id = 1
+        self.inscritos = set()  # Pares (loop, asyncio.Event) das conexões abertas
+        self.trava = Lock()
+
+    def publicar(self, tipo: str, dados: dict):
+        with self.trava:
+            self.eventos.append({"id": self.proximo_id, "tipo": tipo, "dados": dados})
+            self.proximo_id += 1
+            inscritos = list(self.inscritos)
+        for loop, sinal in inscritos:
+            try:
+                loop.call_soon_threadsafe(sinal.set)
+            except RuntimeError:
+                pass  # Loop já encerrado (desligamento da API)
+
+    def inscrever(self) -> tuple:
+        """Registra uma conexão; deve ser chamada dentro do loop de eventos."""
+        inscricao = (asyncio.get_running_loop(), asyncio.Event())
+        with self.trava:
+            self.inscritos.add(inscricao)
+        return inscricao
+
+    def cancelar(self, inscricao: tuple):
+        with self.trava:
+            self.inscritos.discard(inscricao)
+
+    def posteriores(self, ultimo_id: int) -> list:
+        """Retorna os eventos guardados posteriores a `ultimo_id`."""
+        with self.trava:
+            return [evento for evento in self.eventos if evento["id"] > ultimo_id]
+
+
+eventos = BarramentoEventos(EVENTOS_MAX)
+
+
+def publicar_evento(tipo: str, **dados):
+    """Publica um evento de progresso da análise.
+
+    Tipos publicados: "recebida", "baixada", "analisada" (relatório do Trivy
+    processado, com o total de CVEs), "enriquecida" (a N-ésima de M CVEs
+    analisada e gravada), "armazenada" (todas as CVEs de um modelo gravadas),
+    "concluida" e "erro".
+
+    Args:
+        tipo: O tipo do evento.
+        **dados: Os dados do evento. Se `imagem` não for informada, usa a
+            imagem do contexto de log atual.
+    """
+    dados.setdefault("imagem", contexto_log["imagem"].get())
+    eventos.publicar(tipo, dados)
+
+
+@app.get("/eventos")
+async def transmitir_eventos(request: Request):
+    """Transmite os eventos de progresso das análises por Server-Sent Events.
+
+    Ao conectar, o cliente recebe os eventos ainda guardados em memória e, em
+    seguida, os novos, à medida que são publicados. Um comentário é enviado a
+    cada 15 segundos sem eventos para manter a conexão aberta. A espera
+    acontece no loop de eventos, sem ocupar as threads usadas pelas análises,
+    e termina quando o cliente desconecta.
+
+    Args:
+        request: O objeto Request do FastAPI (lido para o cabeçalho Last-Event-ID).
+
+    Returns:
+        Uma StreamingResponse do tipo text/event-stream.
+    """
+    try:
+        ultimo_id = int(request.headers.get("last-event-id", 0))
+    except ValueError:
+        ultimo_id = 0
+    # Após um reinício da API os IDs recomeçam; o cliente recebe tudo novamente.
+    if ultimo_id >= eventos.proximo_id:
+        ultimo_id = 0
+
+    async def gerar():
+        nonlocal ultimo_id
+        inscricao = eventos.inscrever()
+        sinal = inscricao[1]
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                # Limpa o sinal antes de ler: um evento publicado depois disso o sinaliza de novo.
+                sinal.clear()
+                novos = eventos.posteriores(ultimo_id)
+                if not novos:
+                    try:
+                        await asyncio.wait_for(sinal.wait(), timeout=15)
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                    continue
+                for evento in novos:
+                    ultimo_id = evento["id"]
+                    dados = json.dumps(evento["dados"], ensure_ascii=False, default=str)
+                    yield f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {dados}\n\n"
+        finally:
+            eventos.cancelar(inscricao)
+
+    cabecalhos = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Evita que proxies acumulem a resposta
+    }
+    if EVENTOS_ORIGEM:
+        cabecalhos["Access-Control-Allow-Origin"] = EVENTOS_ORIGEM  # A interface web roda em outro servidor
+    return StreamingResponse(gerar(), media_type="text/event-stream", headers=cabecalhos)
 
 
-def ai_LLM(cve_report_content: str) -> dict:
+def ai_LLM(cve_report_content: str, modelo: str | None = None, backend: dict | None = None) -> dict:
     """Envia dados de uma CVE para análise por um modelo de linguagem via API.
 
     Esta função é responsável por enviar o conteúdo dos dados de uma CVE
@@ -158,6 +713,9 @@ def ai_LLM(cve_report_content: str) -> dict:
         cve_report_content: O conteúdo dos dados da CVE, que é esperado
             como uma string JSON ou um objeto que pode ser convertido
             para string para ser enviado à API.
+        modelo: O modelo a ser utilizado. Se omitido, usa o modelo do backend.
+        backend: O backend de IA a ser utilizado. Se omitido, usa o primeiro
+            backend configurado.
 
     Returns:
         Um dicionário contendo a resposta completa do modelo de linguagem,
@@ -166,39 +724,19 @@ def ai_LLM(cve_report_content: str) -> dict:
     # Converte o conteúdo do relatório CVE para uma string.
     # Isso é necessário para que possa ser enviado como 'content' para a IA.
     cve_report_str = str(cve_report_content)
+    backend = backend or BACKENDS_IA[0]
 
     # Realiza a requisição para a API de chat completions da OpenAI.
     # O modelo e as mensagens são configurados para guiar o comportamento da IA.
-    response = openai_client.chat.completions.create(
-        model=config["AI"][
-            "model"
+    response = backend["cliente"].chat.completions.create(
+        model=modelo
+        or backend[
+            "modelo"
         ],  # Define o modelo de IA a ser utilizado, ex: "gpt-4", "deepseek-reasoner"
         messages=[
             {
                 "role": "system",
-                "content": (
-                    "Você é um especialista em segurança da informação, "
-                    "especializado em análise de vulnerabilidades e CVEs "
-                    "para contêineres Docker executados na plataforma FIWARE. "
-                    "Sua função é analisar relatórios de segurança, identificar "
-                    "vulnerabilidades críticas, detalhar os riscos associados "
-                    "a cada CVE e recomendar ações de mitigação. Ao responder, "
-                    "forneça informações técnicas precisas, incluindo o impacto "
-                    "no CID (Confidencialidade, Integridade, Disponibilidade), "
-                    "possíveis vetores de ataque e correções sugeridas. Mantenha "
-                    "a linguagem clara e objetiva, mas com a profundidade "
-                    "necessária para orientar profissionais de cibersegurança. "
-                    "Ao final de cada análise, gere um resumo executivo para "
-                    "facilitar a compreensão do risco por gestores não técnicos. "
-                    "Além disso, avalie o nível de criticidade de cada "
-                    "vulnerabilidade com uma pontuação de 0 a 100, onde 0 "
-                    "indica risco inexistente e 100 indica risco completamente "
-                    "inaceitável. Proponha medidas de resolução que minimizem "
-                    "o risco, priorizando alternativas que não exijam mudanças "
-                    "de versão do sistema, mas sugira essa abordagem se for "
-                    "a opção mais viável para mitigar a ameaça. O parâmetro "
-                    "de entrada será um dicionário Python ou um arquivo json."
-                ),
+                "content": PROMPT_ANALISE_CVE,
             },
             # Envia a informação das CVEs para a IA
             {"role": "user", "content": cve_report_str},
@@ -211,7 +749,394 @@ def ai_LLM(cve_report_content: str) -> dict:
     return response_dict
 
 
-def ai_LLM_resumo_do_cenario(scenario_info: str) -> dict:
+def ai_LLM_lote(lote_cves: list, modelo: str | None = None, backend: dict | None = None) -> dict:
+    """Envia várias CVEs em uma única requisição e pede uma resposta JSON estruturada.
+
+    O prompt de sistema longo é enviado uma única vez para todo o lote, o que
+    reduz o número de requisições e o custo fixo de tokens por CVE. A resposta
+    deve ser validada com `validar_resposta_lote`.
+
+    Args:
+        lote_cves: Lista com os dados de cada CVE a ser analisada (o mesmo
+            conteúdo que seria enviado individualmente para `ai_LLM`).
+        modelo: O modelo a ser utilizado. Se omitido, usa o modelo do backend.
+        backend: O backend de IA a ser utilizado. Se omitido, usa o primeiro
+            backend configurado.
+
+    Returns:
+        Um dicionário contendo a resposta completa do modelo de linguagem.
+    """
+    backend = backend or BACKENDS_IA[0]
+    response = backend["cliente"].chat.completions.create(
+        model=modelo or backend["modelo"],
+        messages=[
+            {"role": "system", "content": f"{PROMPT_ANALISE_CVE} {PROMPT_ANALISE_CVE_LOTE}"},
+            {"role": "user", "content": json.dumps(lote_cves, ensure_ascii=False)},
+        ],
+        response_format={"type": "json_object"},
+    )
+    return response.to_dict()
+
+
+def validar_resposta_lote(response_dict: dict, cve_ids: list) -> dict:
+    """Valida a resposta de uma análise em lote e extrai o relatório de cada CVE.
+
+    Entradas para CVEs que não foram enviadas, duplicadas ou sem relatório são
+    descartadas; as CVEs ausentes do resultado devem ser analisadas novamente.
+
+    Args:
+        response_dict: A resposta retornada por `ai_LLM_lote`.
+        cve_ids: Os IDs das CVEs enviadas no lote.
+
+    Returns:
+        Um dicionário {"CVE-AAAA-NNNN": "relatório em Markdown"} apenas com as
+        CVEs cuja análise é válida.
+    """
+    conteudo = response_dict["choices"][0]["message"].get("content") or ""
+    try:
+        dados = json.loads(conteudo)
+    except json.JSONDecodeError:
+        # Alguns modelos envolvem o JSON em texto ou blocos de código; tenta isolar o objeto.
+        inicio, fim = conteudo.find("{"), conteudo.rfind("}")
+        try:
+            dados = json.loads(conteudo[inicio : fim + 1]) if inicio != -1 else {}
+        except json.JSONDecodeError:
+            return {}
+
+    analises = dados.get("analises") if isinstance(dados, dict) else None
+    relatorios = {}
+    for analise in analises if isinstance(analises, list) else []:
+        if not isinstance(analise, dict):
+            continue
+        cve_id = str(analise.get("cve", "")).strip().upper()
+        relatorio = analise.get("relatorio")
+        if cve_id in cve_ids and cve_id not in relatorios and isinstance(relatorio, str) and relatorio.strip():
+            relatorios[cve_id] = relatorio
+    return relatorios
+
+
+def dividir_resposta_lote(response_dict: dict, relatorio: str, tamanho_lote: int) -> dict:
+    """Cria, a partir da resposta de um lote, uma resposta individual para uma CVE.
+
+    O documento segue o formato das respostas de `ai_LLM`, para que a interface
+    web e a busca leiam os dois modos da mesma forma. O `usage` é dividido
+    proporcionalmente entre as CVEs do lote e o original é mantido em `lote`.
+
+    Args:
+        response_dict: A resposta completa retornada por `ai_LLM_lote`.
+        relatorio: O relatório em Markdown da CVE.
+        tamanho_lote: A quantidade de CVEs enviadas no lote.
+
+    Returns:
+        Um dicionário no formato de uma resposta de chat completions.
+    """
+    usage = response_dict.get("usage") or {}
+    return {
+        "id": response_dict.get("id"),
+        "object": response_dict.get("object"),
+        "created": response_dict.get("created"),
+        "model": response_dict.get("model"),
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": response_dict["choices"][0].get("finish_reason"),
+                "message": {"role": "assistant", "content": relatorio},
+            }
+        ],
+        "usage": {
+            chave: round(valor / tamanho_lote)
+            for chave, valor in usage.items()
+            if isinstance(valor, (int, float))
+        },
+        "lote": {"tamanho": tamanho_lote, "usage": usage},
+    }
+
+
+def ordem_severidade(item: tuple) -> int:
+    """Posição da severidade de uma CVE em `ORDEM_SEVERIDADES` (menor = mais grave).
+
+    Args:
+        item: Uma tupla (cve_id, detailed_cve_info, dados_para_ia).
+    """
+    return ORDEM_SEVERIDADES.get(extrair_severidade(item[2])[0], len(ORDEM_SEVERIDADES))
+
+
+def montar_lotes(cves_para_analise: list, pacotes_por_cve: dict) -> list:
+    """Agrupa as CVEs em lotes limitados por orçamento de tokens e quantidade.
+
+    As CVEs são ordenadas por severidade e, dentro de cada severidade, pelo
+    pacote afetado, para que vulnerabilidades do mesmo pacote sejam analisadas
+    juntas sem que um lote de CVEs menos graves passe à frente das mais graves.
+    O número de tokens é estimado em 4 caracteres por token, aproximação
+    suficiente para respeitar o orçamento.
+
+    Args:
+        cves_para_analise: Lista de tuplas (cve_id, detailed_cve_info, dados_para_ia).
+        pacotes_por_cve: O resultado de `extrair_pacotes_por_cve` para o relatório.
+
+    Returns:
+        Uma lista de lotes, cada um sendo uma lista de tuplas de `cves_para_analise`.
+    """
+    def _pacote(item):
+        pacotes = pacotes_por_cve.get(item[0]) or [{}]
+        return pacotes[0].get("nome") or ""
+
+    lotes, lote_atual, tokens_lote = [], [], 0
+    for item in sorted(cves_para_analise, key=lambda item: (ordem_severidade(item), _pacote(item))):
+        tokens = len(json.dumps(item[2], ensure_ascii=False)) // 4
+        if lote_atual and (
+            tokens_lote + tokens > LOTE_MAX_TOKENS or len(lote_atual) >= LOTE_MAX_CVES
+        ):
+            lotes.append(lote_atual)
+            lote_atual, tokens_lote = [], 0
+        lote_atual.append(item)
+        tokens_lote += tokens
+    if lote_atual:
+        lotes.append(lote_atual)
+    return lotes
+
+
+def nova_varredura(collection_name: str, imagem: str) -> dict:
+    """Cria o estado de uma varredura, usado na contabilização de tokens e no orçamento.
+
+    Args:
+        collection_name: O nome da coleção da imagem.
+        imagem: O nome original da imagem (ex: "mongo:4.4").
+
+    Returns:
+        Um dicionário com o ID da varredura e o total de tokens já gastos.
+    """
+    return {"id": uuid.uuid4().hex, "colecao": collection_name, "imagem": imagem, "tokens": 0}
+
+
+def registrar_consumo(response_dict: dict, modelo: str, varredura: dict):
+    """Soma o consumo de uma resposta da IA aos totais da varredura e do dia.
+
+    Os totais são acumulados com `$inc` na coleção `CONSUMO`, em um documento
+    por varredura e outro por dia e modelo. O custo usa os preços da seção
+    [CUSTOS] do arquivo de configuração (modelos sem preço somam custo zero).
+
+    Args:
+        response_dict: A resposta da API, contendo o bloco `usage`.
+        modelo: O modelo usado na requisição (chave da tabela de preços).
+        varredura: O estado da varredura criado por `nova_varredura`.
+    """
+    usage = response_dict.get("usage") or {}
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    total_tokens = usage.get("total_tokens") or prompt_tokens + completion_tokens
+    reasoning_tokens = (usage.get("completion_tokens_details") or {}).get("reasoning_tokens") or 0
+
+    preco_entrada, preco_saida = PRECOS_MODELOS.get(modelo.lower(), (0.0, 0.0))
+    custo = (prompt_tokens * preco_entrada + completion_tokens * preco_saida) / 1_000_000
+
+    varredura["tokens"] += total_tokens
+    incrementos = {
+        "requisicoes": 1,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "reasoning_tokens": reasoning_tokens,
+        "total_tokens": total_tokens,
+        "custo": custo,
+    }
+    agora = datetime.now(timezone.utc)
+    db[CONSUMO].update_one(
+        {"_id": f"varredura:{varredura['id']}"},
+        {
+            "$inc": {**incrementos, **{f"modelos.{modelo.replace('.', '_')}": total_tokens}},
+            "$set": {"tipo": "varredura", "colecao": varredura["colecao"], "imagem": varredura["imagem"], "atualizado_em": agora},
+            "$setOnInsert": {"inicio": agora},
+        },
+        upsert=True,
+    )
+    dia = agora.strftime("%Y-%m-%d")
+    db[CONSUMO].update_one(
+        {"_id": f"dia:{dia}:{modelo}"},
+        {"$inc": incrementos, "$set": {"tipo": "dia", "dia": dia, "modelo": modelo}},
+        upsert=True,
+    )
+
+
+def escolher_modelo(dados_para_ia: dict, pacotes: list, backend: dict) -> str | None:
+    """Aplica a política de roteamento da seção [ROTEAMENTO] a uma CVE.
+
+    CVEs de severidade listada em `severidades_sem_ia` (ou sem correção, se
+    `sem_correcao = sem_ia`) recebem apenas um resumo gerado por modelo de
+    texto, sem IA. As de severidade listada em `severidades_economicas` (ou
+    sem correção, se `sem_correcao = economico`) vão para o modelo econômico.
+
+    Args:
+        dados_para_ia: Os dados do NVD da CVE.
+        pacotes: Os pacotes afetados pela CVE, segundo o Trivy.
+        backend: O backend de IA, que define os modelos principal e econômico.
+
+    Returns:
+        O nome do modelo que deve analisar a CVE, ou None para o resumo sem IA.
+    """
+    severidade = extrair_severidade(dados_para_ia)[0]
+    tem_correcao = any(pacote.get("versao_corrigida") for pacote in pacotes)
+
+    if severidade in SEVERIDADES_SEM_IA or (not tem_correcao and ROTA_SEM_CORRECAO == "sem_ia"):
+        return None
+    if backend["modelo_economico"] and (
+        severidade in SEVERIDADES_ECONOMICAS or (not tem_correcao and ROTA_SEM_CORRECAO == "economico")
+    ):
+        return backend["modelo_economico"]
+    return backend["modelo"]
+
+
+def relatorio_sem_ia(dados_para_ia: dict, pacotes: list, motivo: str) -> dict:
+    """Gera um resumo da CVE a partir de um modelo de texto, sem chamar a IA.
+
+    Usado para CVEs roteadas para fora da IA ou quando o orçamento de tokens
+    da imagem se esgota. O resultado tem o formato de uma resposta de chat
+    completions, para ser armazenado e exibido como as demais análises.
+
+    Args:
+        dados_para_ia: Os dados do NVD da CVE.
+        pacotes: Os pacotes afetados pela CVE, segundo o Trivy.
+        motivo: O motivo de a CVE não ter sido analisada pela IA.
+
+    Returns:
+        Um dicionário no formato de uma resposta de chat completions, com `usage` zerado.
+    """
+    severidade, score = extrair_severidade(dados_para_ia)
+    descricao = next(
+        (d["value"] for d in dados_para_ia.get("descriptions", []) if d.get("lang") == "en"),
+        "Descrição não disponível.",
+    )
+    linhas = [
+        f"## {dados_para_ia.get('id')}",
+        "",
+        f"*Resumo gerado sem IA ({motivo}).*",
+        "",
+        f"**Severidade:** {severidade}" + (f" (score {score})" if score is not None else ""),
+        "",
+        f"**Descrição (NVD):** {descricao}",
+        "",
+        "### Pacotes afetados",
+    ]
+    for pacote in pacotes:
+        correcao = (
+            f"corrigido em {pacote['versao_corrigida']}"
+            if pacote.get("versao_corrigida")
+            else "sem correção disponível"
+        )
+        linhas.append(f"- `{pacote.get('nome')}` {pacote.get('versao_instalada')} ({correcao})")
+    linhas += [
+        "",
+        "### Recomendação",
+        "Atualize os pacotes afetados para as versões corrigidas indicadas."
+        if any(pacote.get("versao_corrigida") for pacote in pacotes)
+        else "Não há versão corrigida disponível: monitore a CVE e avalie controles compensatórios.",
+    ]
+    return {
+        "id": f"sem-ia-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(datetime.now(timezone.utc).timestamp()),
+        "model": "sem-ia",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "\n".join(linhas)},
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def gerar_relatorios_cves(cves_para_analise: list, pacotes_por_cve: dict, varredura: dict, backend: dict):
+    """Gera os relatórios das CVEs aplicando roteamento, orçamento e lotes.
+
+    As CVEs são ordenadas da mais grave para a menos grave e roteadas por
+    `escolher_modelo`. Com `lote_max_tokens` igual a 0 no arquivo de
+    configuração, cada CVE é enviada em uma requisição; caso contrário, as
+    CVEs de cada modelo são agrupadas por `montar_lotes` e os lotes são
+    enviados a partir do que contém a CVE mais grave; apenas as CVEs que
+    falharem na validação (ou todas do lote, se a requisição falhar) são
+    reenviadas individualmente. Quando a varredura atinge o orçamento de
+    tokens da imagem, as CVEs restantes (inclusive as que seriam
+    reenviadas) recebem o resumo sem IA.
+
+    Args:
+        cves_para_analise: Lista de tuplas (cve_id, detailed_cve_info, dados_para_ia).
+        pacotes_por_cve: O resultado de `extrair_pacotes_por_cve` para o relatório.
+        varredura: O estado da varredura criado por `nova_varredura`.
+        backend: O backend de IA que fará as análises.
+
+    Yields:
+        Tuplas (cve_id, detailed_cve_info, ai_cve_report), à medida que ficam prontas.
+    """
+    def _analisar_individual(item, modelo):
+        response_dict = ai_LLM(item[2], modelo, backend)
+        registrar_consumo(response_dict, modelo, varredura)
+        return item[0], item[1], response_dict
+
+    def _orcamento_esgotado():
+        return ORCAMENTO_TOKENS_IMAGEM > 0 and varredura["tokens"] >= ORCAMENTO_TOKENS_IMAGEM
+
+    cves_ordenadas = sorted(cves_para_analise, key=ordem_severidade)
+    cves_por_modelo = {}
+    for item in cves_ordenadas:
+        pacotes = pacotes_por_cve.get(item[0], [])
+        modelo = escolher_modelo(item[2], pacotes, backend)
+        if modelo is None:
+            yield item[0], item[1], relatorio_sem_ia(item[2], pacotes, "política de roteamento")
+        else:
+            cves_por_modelo.setdefault(modelo, []).append(item)
+
+    # Os lotes de todos os modelos são enviados a partir do que contém a CVE mais grave,
+    # para que o orçamento de tokens seja gasto primeiro com as vulnerabilidades mais graves.
+    lotes = []
+    for modelo, itens in cves_por_modelo.items():
+        lotes_modelo = montar_lotes(itens, pacotes_por_cve) if LOTE_MAX_TOKENS > 0 else [[item] for item in itens]
+        lotes += [(modelo, lote) for lote in lotes_modelo]
+    lotes.sort(key=lambda modelo_lote: min(ordem_severidade(item) for item in modelo_lote[1]))
+
+    for modelo, lote in lotes:
+        if _orcamento_esgotado():
+            logging.warning(
+                "Orçamento de tokens da imagem '%s' esgotado. %d CVE(s) receberão resumo sem IA.",
+                varredura["imagem"],
+                len(lote),
+            )
+            for cve_id, detailed_cve_info, dados_para_ia in lote:
+                yield cve_id, detailed_cve_info, relatorio_sem_ia(
+                    dados_para_ia, pacotes_por_cve.get(cve_id, []), "orçamento de tokens da imagem esgotado"
+                )
+            continue
+
+        if len(lote) == 1:
+            yield _analisar_individual(lote[0], modelo)
+            continue
+
+        cve_ids = [item[0] for item in lote]
+        try:
+            response_dict = ai_LLM_lote([item[2] for item in lote], modelo, backend)
+            registrar_consumo(response_dict, modelo, varredura)
+            relatorios = validar_resposta_lote(response_dict, cve_ids)
+        except Exception as e:
+            logging.error("Erro na análise em lote das CVEs %s: %s", cve_ids, e)
+            response_dict, relatorios = None, {}
+        logging.info("Lote de %d CVEs analisado: %d relatórios válidos.", len(lote), len(relatorios))
+
+        for item in lote:
+            if item[0] in relatorios:
+                yield item[0], item[1], dividir_resposta_lote(
+                    response_dict, relatorios[item[0]], len(lote)
+                )
+            elif _orcamento_esgotado():
+                yield item[0], item[1], relatorio_sem_ia(
+                    item[2], pacotes_por_cve.get(item[0], []), "orçamento de tokens da imagem esgotado"
+                )
+            else:
+                # Reenvia individualmente apenas as CVEs que falharam no lote.
+                logging.warning("CVE '%s' sem relatório válido no lote. Reenviando individualmente.", item[0])
+                yield _analisar_individual(item, modelo)
+
+
+def ai_LLM_resumo_do_cenario(scenario_info: str, backend: dict | None = None) -> dict:
     """Cria um resumo de cenário com base em informações de metadados do Trivy.
 
     Esta função é responsável por enviar informações de metadados de um
@@ -225,6 +1150,8 @@ def ai_LLM_resumo_do_cenario(scenario_info: str) -> dict:
         scenario_info: O conteúdo da informação de cenário, tipicamente
             extraído do campo 'metadata' de um relatório JSON gerado pelo Trivy.
             É esperado como uma string ou um objeto que pode ser convertido para string.
+        backend: O backend de IA a ser utilizado. Se omitido, usa o primeiro
+            backend configurado.
 
     Returns:
         Um dicionário contendo a resposta completa do modelo de linguagem,
@@ -238,8 +1165,9 @@ def ai_LLM_resumo_do_cenario(scenario_info: str) -> dict:
 
     # Realiza a requisição para a API de chat completions da OpenAI.
     # O modelo e as mensagens são configurados para guiar o comportamento da IA.
-    response = openai_client.chat.completions.create(
-        model=config["AI"]["model"],  # Define o modelo de IA a ser utilizado.
+    backend = backend or BACKENDS_IA[0]
+    response = backend["cliente"].chat.completions.create(
+        model=backend["modelo"],  # Define o modelo de IA a ser utilizado.
         messages=[
             {
                 "role": "system",
@@ -300,7 +1228,7 @@ def detalhar_CVE(cve_id: str) -> dict | None:
     # Verifica se o ID da CVE limpo corresponde ao padrão esperado.
     if not cve_pattern.match(cleaned_cve_id):
         logging.error(
-            f"'{cleaned_cve_id}' não está no formato CVE esperado. Pulando análise."
+            "'%s' não está no formato CVE esperado. Pulando análise.", cleaned_cve_id
         )
         return None  # Retorna None para indicar que o formato é inválido.
 
@@ -318,7 +1246,7 @@ def detalhar_CVE(cve_id: str) -> dict | None:
 
     except Exception as e:
         # Captura qualquer exceção que ocorra durante a busca ou conversão.
-        logging.error(f"Erro ao buscar detalhes da CVE '{cleaned_cve_id}': {e}")
+        logging.error("Erro ao buscar detalhes da CVE '%s': %s", cleaned_cve_id, e)
         return None  # Retorna None em caso de erro na busca.
 
 
@@ -371,78 +1299,1129 @@ def extrair_ids_vulnerabilidades(trivy_report: dict | list) -> list:
     unique_vulnerability_ids = list(set(found_vulnerability_ids))
 
     logging.info(
-        f"Extraídos {len(unique_vulnerability_ids)} IDs de vulnerabilidade únicos do relatório Trivy."
+        "Extraídos %d IDs de vulnerabilidade únicos do relatório Trivy.", len(unique_vulnerability_ids)
     )
     return unique_vulnerability_ids
 
 
-def rodar(trivy_full_report: dict, output_file_path: str):
-    """Processa um relatório completo do Trivy, analisa CVEs com IA e armazena os resultados.
+def extrair_pacotes_por_cve(trivy_report: dict) -> dict:
+    """Agrupa os pacotes afetados de um relatório Trivy pelo ID da vulnerabilidade.
 
-    Esta função orquestra o fluxo de trabalho de análise de um relatório Trivy.
-    Ela extrai informações-chave do relatório, solicita um resumo de cenário à IA,
-    busca detalhes de CVEs individuais, gera relatórios de IA para cada CVE
-    e armazena os resultados em uma coleção MongoDB dedicada para a imagem.
+    Diferente de `extrair_ids_vulnerabilidades`, esta função percorre apenas a
+    estrutura conhecida `Results[].Vulnerabilities[]`, pois precisa das informações
+    do pacote que acompanham cada ocorrência da vulnerabilidade.
 
     Args:
-        trivy_full_report: O dicionário completo do relatório de análise Trivy
-                           da imagem Docker.
-        output_file_path: O caminho do arquivo onde o relatório Trivy foi salvo
-                          (usado apenas para fins de log, não para leitura).
-    """
-    # Extrai metadados da imagem no relatório do Trivy, excluindo os resultados de vulnerabilidades.
-    docker_metadata = {
-        key: value for key, value in trivy_full_report.items() if key != "Results"
-    }
+        trivy_report: O dicionário completo do relatório de análise Trivy.
 
-    # Gera um resumo do cenário da imagem utilizando a IA.
-    scenario_summary_ai_response = ai_LLM_resumo_do_cenario(docker_metadata)
-    logging.info("Resumo do cenário da imagem gerado pela IA.")
+    Returns:
+        Um dicionário no formato {"CVE-AAAA-NNNN": [pacote, ...]}, onde cada pacote
+        contém nome, versão instalada, versão corrigida, alvo e severidade segundo o Trivy.
+    """
+    pacotes_por_cve = {}
+    for resultado in trivy_report.get("Results") or []:
+        for vuln in resultado.get("Vulnerabilities") or []:
+            pacote = {
+                "nome": vuln.get("PkgName"),
+                "versao_instalada": vuln.get("InstalledVersion"),
+                "versao_corrigida": vuln.get("FixedVersion"),
+                "alvo": resultado.get("Target"),
+                "severidade": vuln.get("Severity"),
+                "camada": (vuln.get("Layer") or {}).get("DiffID"),
+            }
+            pacotes = pacotes_por_cve.setdefault(vuln["VulnerabilityID"], [])
+            # O mesmo pacote pode aparecer repetido em alvos idênticos; evita duplicatas.
+            if pacote not in pacotes:
+                pacotes.append(pacote)
+    return pacotes_por_cve
+
+
+def atualizar_indice_cves(collection_name: str, trivy_full_report: dict, pacotes_por_cve: dict):
+    """Atualiza o índice invertido que relaciona cada CVE às imagens afetadas.
+
+    Cada par (CVE, imagem) vira um documento na coleção `INDICE_CVES`, indexada
+    por CVE e por nome de pacote. Assim, descobrir quais imagens são afetadas por
+    uma CVE é uma única consulta indexada, e não uma varredura de todas as coleções.
+    Entradas de CVEs que não aparecem mais na imagem são removidas.
 
-    # Define o nome da coleção MongoDB com base no nome da imagem Trivy e se conecta a ele.
-    collection_name = (
-        trivy_full_report["ArtifactName"].replace("/", "_").replace(":", "_")
+    Args:
+        collection_name: O nome da coleção da imagem analisada.
+        trivy_full_report: O dicionário completo do relatório de análise Trivy.
+        pacotes_por_cve: O resultado de `extrair_pacotes_por_cve` para o relatório.
+    """
+    metadata = trivy_full_report.get("Metadata") or {}
+    repo_digests = metadata.get("RepoDigests") or []
+    digest = repo_digests[0] if repo_digests else metadata.get("ImageID")
+    agora = datetime.now(timezone.utc)
+
+    operacoes = [
+        pymongo.ReplaceOne(
+            {"_id": f"{cve_id}|{collection_name}"},
+            {
+                "cve": cve_id,
+                "colecao": collection_name,
+                "imagem": trivy_full_report.get("ArtifactName"),
+                "digest": digest,
+                "pacotes": pacotes,
+                "atualizado_em": agora,
+            },
+            upsert=True,
+        )
+        for cve_id, pacotes in pacotes_por_cve.items()
+    ]
+
+    indice = db[INDICE_CVES]
+    if operacoes:
+        indice.bulk_write(operacoes, ordered=False)
+    # Remove do índice as CVEs que deixaram de afetar esta imagem.
+    indice.delete_many(
+        {"colecao": collection_name, "cve": {"$nin": list(pacotes_por_cve)}}
+    )
+    logging.info(
+        "Índice de CVEs atualizado com %d entradas para '%s'.", len(operacoes), collection_name
     )
-    collection = db[collection_name]
-    logging.info(f"Conectado à coleção MongoDB: '{collection_name}'")
 
-    # Prepara o documento com o resumo do cenário da imagem docker gerado pela IA e insere no MongoDB.
-    document_scenario_ai_analysis = {
-        "analise_do_container": scenario_summary_ai_response
-    }
-    collection.insert_one(document_scenario_ai_analysis)
-    logging.info("Resumo da análise do container pela IA inserido no MongoDB.")
 
-    # Processa cada CVE encontrada no relatório Trivy individualmente.
-    for cve_id in extrair_ids_vulnerabilidades(trivy_full_report):
-        logging.info(f"Iniciando detalhamento e análise de IA para CVE: {cve_id}")
+def extrair_severidade(cve_info: dict) -> tuple:
+    """Obtém a severidade e o score CVSS de um registro do NVD.
+
+    Segue a mesma prioridade usada na interface web: CVSS v3.1, depois v3.0
+    e, por último, a v2 (legado).
+
+    Args:
+        cve_info: Um registro de CVE retornado por `detalhar_CVE` (o item da lista).
+
+    Returns:
+        Uma tupla (severidade, score). Retorna ("UNKNOWN", None) se não houver métricas.
+    """
+    metrics = cve_info.get("metrics") or {}
+    for chave in ("cvssMetricV31", "cvssMetricV30"):
+        if metrics.get(chave):
+            cvss_data = metrics[chave][0].get("cvssData", {})
+            return cvss_data.get("baseSeverity", "UNKNOWN"), cvss_data.get("baseScore")
+    if metrics.get("cvssMetricV2"):
+        metrica_v2 = metrics["cvssMetricV2"][0]
+        return metrica_v2.get("baseSeverity", "UNKNOWN"), metrica_v2.get("cvssData", {}).get("baseScore")
+    return "UNKNOWN", None
+
+
+def indexar_busca(collection_name: str, documento: dict):
+    """Insere ou atualiza um documento de CVE no índice de busca textual.
+
+    O documento de busca usa o mesmo `_id` do documento da CVE na coleção da
+    imagem, permitindo que a interface web leve direto ao relatório encontrado.
+
+    Args:
+        collection_name: O nome da coleção da imagem onde o documento está salvo.
+        documento: O documento da CVE como armazenado no MongoDB (com `_id`).
+    """
+    if not documento.get("cve"):
+        return  # Registros vazios do NVD não têm conteúdo a indexar
+
+    cve_info = documento["cve"][0]
+    severidade, score = extrair_severidade(cve_info)
+
+    # Usa a descrição em inglês do NVD, que é a única sempre presente.
+    descricao = next(
+        (d["value"] for d in cve_info.get("descriptions", []) if d.get("lang") == "en"),
+        "",
+    )
+    try:
+        relatorio = documento["relatorio"]["choices"][0]["message"]["content"] or ""
+    except (KeyError, IndexError, TypeError):
+        relatorio = ""
+
+    db[BUSCA].replace_one(
+        {"_id": documento["_id"]},
+        {
+            "colecao": collection_name,
+            "cve": cve_info["id"],
+            "modelo": documento.get("modelo"),
+            "severidade": severidade,
+            "score": score,
+            "descricao": descricao,
+            "relatorio": relatorio,
+        },
+        upsert=True,
+    )
+
+
+def registrar_versao(collection_name: str, imagem: str | None = None, modelo: str | None = None):
+    """Incrementa a versão da coleção de uma imagem a cada alteração gravada.
+
+    A interface web usa essa versão e a data da última alteração para gerar os
+    cabeçalhos ETag e Last-Modified, respondendo 304 aos clientes que já possuem
+    os dados mais recentes sem precisar consultar a coleção da imagem.
+
+    Args:
+        collection_name: O nome da coleção da imagem alterada.
+        imagem: O nome original da imagem (ex: "mongo:4.4"). Opcional.
+        modelo: O nome do backend de IA, no modo com vários modelos. Opcional.
+    """
+    campos = {"atualizado_em": datetime.now(timezone.utc)}
+    if imagem:
+        campos["imagem"] = imagem
+    atualizacao = {"$inc": {"versao": 1}, "$set": campos}
+    if modelo:
+        # Lista de modelos com resultados na coleção, usada na comparação lado a lado
+        atualizacao["$addToSet"] = {"modelos": modelo}
+    db[VARREDURAS].update_one({"_id": collection_name}, atualizacao, upsert=True)
+
+
+def compactar_documento(documento: dict) -> dict:
+    """Prepara um documento para gravação de acordo com o modo de armazenamento.
+
+    No modo "compacto", cada campo conhecido é dividido em duas partes: os campos
+    usados em consultas e listagens (ID, métricas, datas, modelo e `usage`)
+    continuam como campos simples, e o restante (descrições, configurações,
+    referências e o texto das respostas da IA) é gravado como um blob JSON
+    comprimido com zlib no campo `<campo>_zlib`. A interface web reconstrói o
+    documento original com `expandir_documento`.
+
+    Args:
+        documento: O documento completo, como seria gravado no modo "completo".
+
+    Returns:
+        O próprio documento no modo "completo", ou um novo documento compactado.
+    """
+    if MODO_ARMAZENAMENTO != "compacto":
+        return documento
+
+    compacto = {}
+    for campo, valor in documento.items():
+        if campo == "cve":
+            simples = [
+                {k: v for k, v in item.items() if k not in CAMPOS_COMPRIMIDOS_CVE}
+                for item in valor
+            ]
+            comprimido = [
+                {k: v for k, v in item.items() if k in CAMPOS_COMPRIMIDOS_CVE}
+                for item in valor
+            ]
+        elif campo in ("relatorio", "analise_do_container"):
+            simples = {k: valor[k] for k in CAMPOS_SIMPLES_RESPOSTA_IA if k in valor}
+            simples["choices"] = [
+                {"index": c.get("index"), "finish_reason": c.get("finish_reason")}
+                for c in valor.get("choices", [])
+            ]
+            comprimido = {k: v for k, v in valor.items() if k not in CAMPOS_SIMPLES_RESPOSTA_IA}
+        else:
+            compacto[campo] = valor
+            continue
+
+        compacto[campo] = simples
+        compacto[f"{campo}_zlib"] = Binary(
+            zlib.compress(json.dumps(comprimido, ensure_ascii=False).encode("utf-8"))
+        )
+    return compacto
+
+
+def _mesclar(base, sobreposicao):
+    """Mescla recursivamente dicionários e listas (por posição), priorizando a sobreposição."""
+    if isinstance(base, dict) and isinstance(sobreposicao, dict):
+        for chave, valor in sobreposicao.items():
+            base[chave] = _mesclar(base.get(chave), valor)
+        return base
+    if isinstance(base, list) and isinstance(sobreposicao, list):
+        for indice, valor in enumerate(sobreposicao):
+            if indice < len(base):
+                base[indice] = _mesclar(base[indice], valor)
+            else:
+                base.append(valor)
+        return base
+    return sobreposicao
+
+
+def expandir_documento(documento: dict) -> dict:
+    """Reconstrói um documento gravado no modo compacto (operação inversa de `compactar_documento`).
+
+    Documentos gravados no modo completo são retornados sem alterações.
+
+    Args:
+        documento: O documento como lido do MongoDB.
+
+    Returns:
+        O documento com os campos comprimidos descomprimidos e mesclados.
+    """
+    for campo in ("cve", "relatorio", "analise_do_container"):
+        blob = documento.pop(f"{campo}_zlib", None)
+        if blob is not None:
+            comprimido = json.loads(zlib.decompress(blob).decode("utf-8"))
+            documento[campo] = _mesclar(comprimido, documento.get(campo))
+
+    # Os detalhes do NVD e os relatórios das CVEs da camada base ficam em BASES_CVES e são apenas
+    # referenciados; os detalhes guardados na base (possivelmente renovados) têm prioridade.
+    referencia = documento.pop("relatorio_ref", None)
+    if referencia:
+        compartilhado = db[BASES_CVES].find_one(
+            {"_id": referencia["base"]},
+            {"cve": True, "cve_zlib": True, f"relatorios.{referencia['modelo']}": True},
+        ) or {}
+        relatorio = (compartilhado.pop("relatorios", None) or {}).get(referencia["modelo"])
+        if relatorio:
+            documento["relatorio"] = expandir_documento(relatorio)["relatorio"]
+        detalhes = expandir_documento(compartilhado).get("cve")
+        if detalhes:
+            documento["cve"] = _mesclar(documento.get("cve") or [], detalhes)
+    return documento
+
+
+def armazenar_cve(
+    collection,
+    collection_name: str,
+    detailed_cve_info: list,
+    ai_cve_report: dict,
+    modelo: str | None = None,
+    relatorio_ref: dict | None = None,
+):
+    """Grava o documento de uma CVE analisada e o disponibiliza para a busca textual.
+
+    Args:
+        collection: A coleção MongoDB da imagem.
+        collection_name: O nome da coleção da imagem.
+        detailed_cve_info: Os detalhes da CVE retornados por `detalhar_CVE`.
+        ai_cve_report: A resposta da IA com a análise da CVE.
+        modelo: O nome do backend de IA, no modo com vários modelos. Opcional.
+        relatorio_ref: A referência à CVE compartilhada da camada base,
+            retornada por `guardar_relatorio_base`. Se informada, o relatório
+            e os campos volumosos do NVD não são copiados para a coleção da
+            imagem, que guarda apenas os campos usados nas consultas. Opcional.
+
+    Returns:
+        O _id do documento gravado, como string.
+    """
+    # O _id é gerado antes para que o índice de busca receba o documento ainda não compactado.
+    cve_document_for_db = {"_id": ObjectId(), "cve": detailed_cve_info, "relatorio": ai_cve_report}
+    if modelo:
+        cve_document_for_db["modelo"] = modelo
+    if relatorio_ref:
+        documento_gravado = {
+            "_id": cve_document_for_db["_id"],
+            "cve": [
+                {k: v for k, v in item.items() if k not in CAMPOS_COMPRIMIDOS_CVE}
+                for item in detailed_cve_info
+            ],
+            "relatorio_ref": relatorio_ref,
+        }
+        if modelo:
+            documento_gravado["modelo"] = modelo
+    else:
+        documento_gravado = compactar_documento(cve_document_for_db)
+    collection.insert_one(documento_gravado)
+    indexar_busca(collection_name, cve_document_for_db)
+    registrar_versao(collection_name, modelo=modelo)
+    return str(cve_document_for_db["_id"])
+
+
+# ========== Deduplicação Por Camada Base ========== #
+def identificar_camada_base(trivy_full_report: dict) -> dict | None:
+    """Identifica a camada base (sistema operacional) de uma imagem no relatório do Trivy.
+
+    A base é a primeira camada da imagem (o rootfs do SO, como em ubuntu:20.04
+    ou alpine:3.22), identificada pelo DiffID e pela família e versão do SO.
+    Imagens construídas sobre a mesma base geram a mesma chave.
+
+    Args:
+        trivy_full_report: O dicionário completo do relatório de análise Trivy.
+
+    Returns:
+        Um dicionário com a chave, o nome do SO e o DiffID da base, ou None se o
+        relatório não informar o SO ou as camadas da imagem.
+    """
+    metadata = trivy_full_report.get("Metadata") or {}
+    diff_ids = metadata.get("DiffIDs") or (
+        (metadata.get("ImageConfig") or {}).get("rootfs") or {}
+    ).get("diff_ids")
+    sistema = metadata.get("OS") or {}
+    if not diff_ids or not sistema.get("Family"):
+        return None
+
+    nome_so = f"{sistema['Family']} {sistema.get('Name', '')}".strip()
+    return {
+        "chave": f"{sistema['Family']}:{sistema.get('Name', '')}|{diff_ids[0]}",
+        "os": nome_so,
+        "diff_id": diff_ids[0],
+    }
+
+
+def separar_metadados(docker_metadata: dict, base: dict) -> tuple:
+    """Separa os metadados da imagem entre a camada base e as camadas da aplicação.
+
+    No histórico da imagem, cada entrada sem `empty_layer` corresponde a uma
+    camada; as entradas anteriores à segunda camada pertencem à base.
+
+    Args:
+        docker_metadata: Os metadados do relatório Trivy (sem os resultados).
+        base: A camada base retornada por `identificar_camada_base`.
+
+    Returns:
+        Uma tupla (metadados_base, metadados_aplicacao).
+    """
+    metadata = docker_metadata.get("Metadata") or {}
+    config_imagem = metadata.get("ImageConfig") or {}
+    historico = config_imagem.get("history") or []
+
+    corte = len(historico)
+    camadas = 0
+    for indice, entrada in enumerate(historico):
+        if not entrada.get("empty_layer"):
+            camadas += 1
+            if camadas == 2:
+                corte = indice
+                break
+
+    metadados_base = {"OS": metadata.get("OS"), "DiffID": base["diff_id"], "history": historico[:corte]}
+    metadados_aplicacao = {
+        **docker_metadata,
+        "Metadata": {**metadata, "ImageConfig": {**config_imagem, "history": historico[corte:]}},
+        # A base é analisada separadamente; a IA recebe apenas a sua identificação.
+        "ImagemBase": f"{base['os']} (camada {base['diff_id']})",
+    }
+    return metadados_base, metadados_aplicacao
+
+
+def cves_da_camada_base(pacotes_por_cve: dict, base: dict | None) -> set:
+    """Retorna as CVEs encontradas apenas em pacotes da camada base.
+
+    CVEs que também aparecem em camadas da aplicação continuam sendo
+    analisadas por imagem.
+
+    Args:
+        pacotes_por_cve: O resultado de `extrair_pacotes_por_cve` para o relatório.
+        base: A camada base retornada por `identificar_camada_base`, ou None.
+
+    Returns:
+        O conjunto de IDs das CVEs da camada base (vazio sem base identificada).
+    """
+    if not base:
+        return set()
+    return {
+        cve_id
+        for cve_id, pacotes in pacotes_por_cve.items()
+        if all(pacote.get("camada") == base["diff_id"] for pacote in pacotes)
+    }
+
+
+def chave_modelo_backend(backend: dict) -> str:
+    """Retorna o identificador de um backend nas coleções das camadas base.
+
+    O ponto não é permitido em nomes de campos usados como caminho no MongoDB,
+    por isso é trocado por "_" (ex: "gemini-2_5-flash").
+    """
+    return (backend["nome"] or backend["modelo"]).replace(".", "_")
+
+
+def obter_resumo_base(base: dict, metadados_base: dict, backend: dict, chave_modelo: str, varredura: dict) -> str:
+    """Retorna o resumo de cenário da camada base, gerando-o pela IA apenas na primeira vez.
+
+    Args:
+        base: A camada base retornada por `identificar_camada_base`.
+        metadados_base: Os metadados da base retornados por `separar_metadados`.
+        backend: O backend de IA que fará a análise.
+        chave_modelo: O identificador do modelo nas coleções das bases.
+        varredura: O estado da varredura criado por `nova_varredura`.
+
+    Returns:
+        O _id do documento da base na coleção BASES.
+    """
+    base_id = f"{base['chave']}|{chave_modelo}"
+    if db[BASES].count_documents({"_id": base_id}, limit=1):
+        logging.info("Resumo da camada base '%s' reaproveitado (%s).", base["os"], chave_modelo)
+        return base_id
+
+    resposta = ai_LLM_resumo_do_cenario(metadados_base, backend)
+    registrar_consumo(resposta, backend["modelo"], varredura)
+    documento_base = {
+        "_id": base_id,
+        "chave": base["chave"],
+        "os": base["os"],
+        "diff_id": base["diff_id"],
+        "modelo": chave_modelo,
+        "analise_do_container": resposta,
+        "atualizado_em": datetime.now(timezone.utc),
+    }
+    db[BASES].replace_one({"_id": base_id}, compactar_documento(documento_base), upsert=True)
+    logging.info("Resumo da camada base '%s' gerado pela IA (%s).", base["os"], chave_modelo)
+    return base_id
+
+
+def relatorios_base_existentes(base: dict, cves_base: set, chave_modelo: str) -> dict:
+    """Busca os relatórios já gerados por um modelo para as CVEs da camada base.
+
+    Args:
+        base: A camada base retornada por `identificar_camada_base`.
+        cves_base: As CVEs da camada base presentes na imagem.
+        chave_modelo: O identificador do modelo nas coleções das bases.
+
+    Returns:
+        Um dicionário {cve_id: relatório da IA} com as CVEs já analisadas.
+    """
+    campo = f"relatorios.{chave_modelo}"
+    documentos = db[BASES_CVES].find(
+        {"_id": {"$in": [f"{base['chave']}|{cve_id}" for cve_id in cves_base]}, campo: {"$exists": True}},
+        {campo: True},
+    )
+    return {
+        documento["_id"].rsplit("|", 1)[1]: expandir_documento(documento["relatorios"][chave_modelo])["relatorio"]
+        for documento in documentos
+    }
+
+
+def guardar_relatorio_base(base: dict, cve_id: str, ai_cve_report: dict, chave_modelo: str) -> dict:
+    """Guarda o relatório de uma CVE da camada base para as demais imagens.
+
+    Os detalhes do NVD da CVE já foram guardados por `guardar_detalhes_base`.
+
+    Args:
+        base: A camada base retornada por `identificar_camada_base`.
+        cve_id: O ID da CVE.
+        ai_cve_report: A resposta da IA com a análise da CVE.
+        chave_modelo: O identificador do modelo nas coleções das bases.
+
+    Returns:
+        A referência à CVE compartilhada, gravada no campo `relatorio_ref` dos documentos das imagens.
+    """
+    base_id = f"{base['chave']}|{cve_id}"
+    db[BASES_CVES].update_one(
+        {"_id": base_id},
+        {
+            "$set": {
+                "chave": base["chave"],
+                f"relatorios.{chave_modelo}": compactar_documento({"relatorio": ai_cve_report}),
+                "atualizado_em": datetime.now(timezone.utc),
+            }
+        },
+        upsert=True,
+    )
+    return {"base": base_id, "modelo": chave_modelo}
+
+
+def guardar_detalhes_base(base: dict, cve_id: str, detailed_cve_info: list):
+    """Guarda (ou renova) os detalhes do NVD de uma CVE da camada base para as demais imagens.
+
+    Args:
+        base: A camada base retornada por `identificar_camada_base`.
+        cve_id: O ID da CVE.
+        detailed_cve_info: Os detalhes da CVE retornados por `detalhar_CVE`.
+    """
+    db[BASES_CVES].update_one(
+        {"_id": f"{base['chave']}|{cve_id}"},
+        {
+            "$set": {
+                "chave": base["chave"],
+                **compactar_documento({"cve": detailed_cve_info}),
+                "detalhes_em": datetime.now(timezone.utc),
+            }
+        },
+        upsert=True,
+    )
+
+
+def detalhes_base_existentes(base: dict | None, cve_id: str) -> list | None:
+    """Retorna os detalhes do NVD já guardados para uma CVE da camada base, se ainda válidos.
+
+    Detalhes guardados há mais de VALIDADE_DETALHES_BASE_DIAS não são retornados, para
+    que sejam buscados de novo no NVD e renovados por `guardar_detalhes_base`.
+
+    Args:
+        base: A camada base retornada por `identificar_camada_base`, ou None.
+        cve_id: O ID da CVE.
+
+    Returns:
+        Os detalhes da CVE no formato de `detalhar_CVE`, ou None.
+    """
+    if not base:
+        return None
+    filtro = {"_id": f"{base['chave']}|{cve_id}", "cve": {"$exists": True}}
+    if VALIDADE_DETALHES_BASE_DIAS > 0:
+        filtro["detalhes_em"] = {
+            "$gte": datetime.now(timezone.utc) - timedelta(days=VALIDADE_DETALHES_BASE_DIAS)
+        }
+    documento = db[BASES_CVES].find_one(filtro, {"cve": True, "cve_zlib": True})
+    return expandir_documento(documento)["cve"] if documento else None
+
+
+@app.post("/reindexar-busca")
+def reindexar_busca():
+    """Reconstrói o índice de busca textual a partir das coleções das imagens.
+
+    Útil para indexar análises gravadas antes da existência do índice de busca.
+
+    Returns:
+        Um JSON com o número de documentos indexados.
+    """
+    total = 0
+    for collection_name in db.list_collection_names():
+        if collection_name.startswith("_"):
+            continue  # Coleções auxiliares não contêm CVEs
+        for documento in db[collection_name].find({"cve": {"$exists": True}}):
+            indexar_busca(collection_name, expandir_documento(documento))
+            total += 1
+
+    logging.info("Índice de busca reconstruído com %d documentos.", total)
+    return {"message": "Índice de busca reconstruído.", "documentos": total}
+
+
+@app.get("/consumo")
+def consultar_consumo(dias: int = 30):
+    """Retorna o consumo de tokens e o custo da IA por dia e das últimas varreduras.
+
+    Args:
+        dias: Quantidade de dias mais recentes a incluir.
+
+    Returns:
+        Um JSON com os totais diários (por modelo) e das últimas varreduras.
+    """
+    por_dia = list(
+        db[CONSUMO].find({"tipo": "dia"}, {"_id": False}).sort("dia", pymongo.DESCENDING).limit(dias * 10)
+    )
+    varreduras = list(
+        db[CONSUMO].find({"tipo": "varredura"}).sort("inicio", pymongo.DESCENDING).limit(dias)
+    )
+    for registro in varreduras:
+        registro["varredura"] = registro.pop("_id").removeprefix("varredura:")
+    return {"por_dia": por_dia, "varreduras": varreduras}
+
+
+def detalhar_cves(cve_ids: list, base: dict | None = None, cves_base: set = frozenset()) -> list:
+    """Busca os detalhes das CVEs no NVD e separa os dados que serão enviados à IA.
 
-        # Busca detalhes completos da CVE no NIST NVD.
-        detailed_cve_info = detalhar_CVE(cve_id)
-        if detailed_cve_info is None:
+    Args:
+        cve_ids: Os IDs das CVEs a detalhar.
+        base: A camada base retornada por `identificar_camada_base`. Opcional.
+        cves_base: As CVEs encontradas apenas na camada base, cujos detalhes
+            podem já ter sido obtidos para outra imagem. Opcional.
+
+    Returns:
+        Lista de tuplas (cve_id, detailed_cve_info, dados_para_ia) das CVEs
+        cujos detalhes foram obtidos.
+    """
+    definir_contexto_log(etapa="nvd")
+    cves_para_analise = []
+    for cve_id in cve_ids:
+        # Linhas registradas por CVE usam "%s" para o limite de repetições do log.
+        logging.info("Iniciando detalhamento e análise de IA para CVE: %s", cve_id)
+
+        # Busca detalhes completos da CVE no NIST NVD (ou reaproveita os da camada base).
+        detailed_cve_info = None
+        if cve_id in cves_base:
+            detailed_cve_info = detalhes_base_existentes(base, cve_id)
+        if not detailed_cve_info:
+            detailed_cve_info = detalhar_CVE(cve_id)
+            if detailed_cve_info and cve_id in cves_base:
+                guardar_detalhes_base(base, cve_id, detailed_cve_info)
+        if not detailed_cve_info:
             # Pula a CVE se os detalhes não puderem ser obtidos (insere informação no log).
             logging.warning(
-                f"Detalhes para CVE '{cve_id}' não puderam ser obtidos. Pulando."
+                "Detalhes para CVE '%s' não puderam ser obtidos. Pulando.", cve_id
             )
             continue
         
         #Esse bloco pega apenas as informações úteis para a IA, 
         # isso evita o erro de exesso de tokens de entrada e economiza dinheiro
         dados_para_ia = detailed_cve_info[0].copy() # detalied_cve_info é uma lista com um único argumento.
-        for campo in ['configurations', 'references', 'cpe']:
+        for campo in CAMPOS_VOLUMOSOS_CVE:
             dados_para_ia.pop(campo, None)
-                
-        # Gera um relatório de análise da CVE utilizando a IA.
-        ai_cve_report = ai_LLM(dados_para_ia)
-        logging.info(f"Relatório de IA gerado para CVE: {cve_id}")
+        cves_para_analise.append((cve_id, detailed_cve_info, dados_para_ia))
+    return cves_para_analise
+
+
+def executar_nos_backends(funcao, collection_name: str, *argumentos):
+    """Executa uma etapa de IA em cada backend configurado.
+
+    Com um único backend a etapa roda diretamente; com vários, cada backend
+    roda em sua própria thread e a falha de um não interrompe os demais.
+
+    Args:
+        funcao: A função a executar, que recebe o backend como primeiro argumento.
+        collection_name: O nome da coleção da imagem (usado nos logs de erro).
+        *argumentos: Os demais argumentos repassados à função.
+    """
+    if len(BACKENDS_IA) == 1:
+        funcao(BACKENDS_IA[0], *argumentos)
+        return
+
+    # Cada thread recebe uma cópia do contexto de log (imagem, etapa) da thread atual.
+    with ThreadPoolExecutor(max_workers=len(BACKENDS_IA)) as executor:
+        futuros = {
+            executor.submit(contextvars.copy_context().run, funcao, backend, *argumentos): backend["nome"]
+            for backend in BACKENDS_IA
+        }
+    for futuro, nome in futuros.items():
+        if futuro.exception() is not None:
+            logging.error(
+                "Erro na análise da imagem '%s' com o modelo '%s': %s", collection_name, nome, futuro.exception()
+            )
+
+
+def analisar_com_backend(
+    backend: dict,
+    trivy_full_report: dict,
+    collection_name: str,
+    cves_para_analise: list,
+    pacotes_por_cve: dict,
+    base: dict | None = None,
+    cves_base: set = frozenset(),
+):
+    """Executa as etapas de IA de uma varredura com um backend e armazena os resultados.
+
+    Gera o resumo do cenário da imagem e os relatórios das CVEs já detalhadas
+    pelo NVD. No modo com vários modelos, os documentos gravados recebem o
+    campo `modelo` com o nome do backend. Com a camada base identificada, o
+    resumo da base e os relatórios das CVEs exclusivas dela são gerados uma
+    única vez por modelo e apenas referenciados pelas imagens seguintes.
+
+    Args:
+        backend: O backend de IA que fará as análises.
+        trivy_full_report: O dicionário completo do relatório de análise Trivy.
+        collection_name: O nome da coleção da imagem.
+        cves_para_analise: Lista de tuplas (cve_id, detailed_cve_info, dados_para_ia).
+        pacotes_por_cve: O resultado de `extrair_pacotes_por_cve` para o relatório.
+        base: A camada base retornada por `identificar_camada_base`. Opcional.
+        cves_base: As CVEs encontradas apenas na camada base. Opcional.
+    """
+    collection = db[collection_name]
+    modelo = backend["nome"]
+    chave_modelo = chave_modelo_backend(backend)
+
+    # Extrai metadados da imagem no relatório do Trivy, excluindo os resultados de vulnerabilidades.
+    docker_metadata = {
+        key: value for key, value in trivy_full_report.items() if key != "Results"
+    }
+
+    # Inicia a contabilização de tokens e custo desta varredura.
+    varredura = nova_varredura(collection_name, trivy_full_report["ArtifactName"])
+    definir_contexto_log(varredura=varredura["id"], etapa="cenario")
+
+    # Prepara o documento com o resumo do cenário da imagem docker gerado pela IA.
+    document_scenario_ai_analysis = {}
+    if base:
+        # A base é resumida uma vez por modelo; a imagem recebe apenas o resumo das suas camadas.
+        metadados_base, docker_metadata = separar_metadados(docker_metadata, base)
+        document_scenario_ai_analysis["base"] = obter_resumo_base(
+            base, metadados_base, backend, chave_modelo, varredura
+        )
+
+    # Gera um resumo do cenário da imagem utilizando a IA.
+    scenario_summary_ai_response = ai_LLM_resumo_do_cenario(docker_metadata, backend)
+    registrar_consumo(scenario_summary_ai_response, backend["modelo"], varredura)
+    logging.info("Resumo do cenário da imagem gerado pela IA.")
+
+    # Insere o resumo no MongoDB.
+    document_scenario_ai_analysis["analise_do_container"] = scenario_summary_ai_response
+    if modelo:
+        document_scenario_ai_analysis["modelo"] = modelo
+    collection.insert_one(compactar_documento(document_scenario_ai_analysis))
+    registrar_versao(collection_name, trivy_full_report["ArtifactName"], modelo)
+    logging.info("Resumo da análise do container pela IA inserido no MongoDB.")
+
+    analisar_cves_com_backend(
+        backend, collection_name, cves_para_analise, pacotes_por_cve, varredura, base, cves_base
+    )
+
+
+def analisar_cves_com_backend(
+    backend: dict,
+    collection_name: str,
+    cves_para_analise: list,
+    pacotes_por_cve: dict,
+    varredura: dict,
+    base: dict | None = None,
+    cves_base: set = frozenset(),
+):
+    """Gera e armazena os relatórios da IA das CVEs já detalhadas pelo NVD com um backend.
+
+    Usada tanto na varredura completa de uma imagem quanto na reavaliação do
+    SBOM, que analisa apenas as CVEs novas.
+
+    Args:
+        backend: O backend de IA que fará as análises.
+        collection_name: O nome da coleção da imagem.
+        cves_para_analise: Lista de tuplas (cve_id, detailed_cve_info, dados_para_ia).
+        pacotes_por_cve: O resultado de `extrair_pacotes_por_cve` para o relatório.
+        varredura: O estado da varredura criado por `nova_varredura`.
+        base: A camada base retornada por `identificar_camada_base`. Opcional.
+        cves_base: As CVEs encontradas apenas na camada base. Opcional.
+    """
+    collection = db[collection_name]
+    modelo = backend["nome"]
+    chave_modelo = chave_modelo_backend(backend)
+    definir_contexto_log(varredura=varredura["id"], etapa="ia")
+    progresso = {"atual": 0, "total": len(cves_para_analise)}
+
+    def armazenar_e_publicar(cve_id, detailed_cve_info, ai_cve_report, relatorio_ref=None):
+        """Grava a CVE e publica o progresso (N de M) com os dados para a visualização ao vivo."""
+        documento_id = armazenar_cve(
+            collection, collection_name, detailed_cve_info, ai_cve_report, modelo, relatorio_ref
+        )
+        progresso["atual"] += 1
+        severidade, score = extrair_severidade(detailed_cve_info[0])
+        publicar_evento(
+            "enriquecida",
+            colecao=collection_name,
+            modelo=modelo,
+            cve=cve_id,
+            id=documento_id,
+            severidade=severidade,
+            score=score,
+            **progresso,
+        )
+
+    # CVEs da camada base já analisadas por este modelo em outra imagem são apenas referenciadas.
+    relatorios_base = relatorios_base_existentes(base, cves_base, chave_modelo) if cves_base else {}
+    pendentes = []
+    for cve_id, detailed_cve_info, dados_para_ia in cves_para_analise:
+        if cve_id in relatorios_base:
+            relatorio_ref = {"base": f"{base['chave']}|{cve_id}", "modelo": chave_modelo}
+            armazenar_e_publicar(cve_id, detailed_cve_info, relatorios_base[cve_id], relatorio_ref)
+        else:
+            pendentes.append((cve_id, detailed_cve_info, dados_para_ia))
+    if relatorios_base:
+        logging.info(
+            "%d relatórios de CVEs da camada base '%s' reaproveitados.", len(relatorios_base), base["os"]
+        )
+
+    # Gera os relatórios de análise das CVEs utilizando a IA (individualmente ou em lotes).
+    for cve_id, detailed_cve_info, ai_cve_report in gerar_relatorios_cves(
+        pendentes, pacotes_por_cve, varredura, backend
+    ):
+        logging.info("Relatório de IA gerado para CVE: %s", cve_id)
+
+        # Resumos sem IA (como os do orçamento esgotado) não são compartilhados com outras imagens.
+        relatorio_ref = None
+        if cve_id in cves_base and ai_cve_report.get("model") != "sem-ia":
+            relatorio_ref = guardar_relatorio_base(base, cve_id, ai_cve_report, chave_modelo)
 
         # Combina os detalhes da CVE e o relatório da IA e insere como um documento no MongoDB.
-        cve_document_for_db = {"cve": detailed_cve_info, "relatorio": ai_cve_report}
-        collection.insert_one(cve_document_for_db)
+        armazenar_e_publicar(cve_id, detailed_cve_info, ai_cve_report, relatorio_ref)
         logging.info(
-            f"Documento da CVE '{cve_id}' (detalhes + relatório IA) inserido no MongoDB."
+            "Documento da CVE '%s' (detalhes + relatório IA) inserido no MongoDB.", cve_id
         )
 
+    publicar_evento("armazenada", colecao=collection_name, modelo=modelo, cves=progresso["atual"])
     logging.info(
-        f"Fim da análise e armazenamento para a imagem associada ao arquivo: {output_file_path}"
+        "Varredura %s (%s) consumiu %d tokens da IA.", varredura["id"], backend["modelo"], varredura["tokens"]
     )
+
+
+def rodar(trivy_full_report: dict, output_file_path: str):
+    """Processa um relatório completo do Trivy, analisa CVEs com IA e armazena os resultados.
+
+    Esta função orquestra o fluxo de trabalho de análise de um relatório Trivy.
+    Ela extrai informações-chave do relatório, busca detalhes de CVEs individuais
+    e, para cada backend de IA configurado, solicita um resumo de cenário e gera
+    relatórios de IA para cada CVE, armazenando os resultados em uma coleção
+    MongoDB dedicada para a imagem. Com vários backends, as etapas do Trivy e do
+    NVD são executadas uma única vez e as análises de IA rodam em paralelo. As CVEs
+    exclusivas da camada base reaproveitam os dados já obtidos para outras imagens
+    construídas sobre a mesma base.
+
+    Args:
+        trivy_full_report: O dicionário completo do relatório de análise Trivy
+                           da imagem Docker.
+        output_file_path: O caminho do arquivo onde o relatório Trivy foi salvo
+                          (usado apenas para fins de log, não para leitura).
+    """
+    # Define o nome da coleção MongoDB com base no nome da imagem Trivy e se conecta a ele.
+    collection_name = (
+        trivy_full_report["ArtifactName"].replace("/", "_").replace(":", "_")
+    )
+    definir_contexto_log(imagem=trivy_full_report["ArtifactName"], etapa="indice")
+    logging.info("Conectado à coleção MongoDB: '%s'", collection_name)
+
+    # Mantém o índice invertido CVE -> imagens atualizado com as descobertas do Trivy.
+    pacotes_por_cve = extrair_pacotes_por_cve(trivy_full_report)
+    atualizar_indice_cves(collection_name, trivy_full_report, pacotes_por_cve)
+
+    # Identifica a camada base e as CVEs exclusivas dela, compartilhadas entre imagens.
+    base = identificar_camada_base(trivy_full_report) if DEDUPLICAR_CAMADA_BASE else None
+    cves_base = cves_da_camada_base(pacotes_por_cve, base)
+    if base:
+        logging.info("Camada base '%s' com %d CVEs exclusivas.", base["os"], len(cves_base))
+
+    cve_ids = extrair_ids_vulnerabilidades(trivy_full_report)
+    publicar_evento("analisada", colecao=collection_name, cves=len(cve_ids))
+
+    # Busca os detalhes de cada CVE encontrada no relatório Trivy.
+    cves_para_analise = detalhar_cves(cve_ids, base, cves_base)
+
+    executar_nos_backends(
+        analisar_com_backend,
+        collection_name,
+        trivy_full_report,
+        collection_name,
+        cves_para_analise,
+        pacotes_por_cve,
+        base,
+        cves_base,
+    )
+
+    logging.info(
+        "Fim da análise e armazenamento para a imagem associada ao arquivo: %s", output_file_path
+    )
+
+
+# ========== Reavaliação Dos SBOMs ========== #
+reavaliacao_em_andamento = Lock()  # Impede duas reavaliações simultâneas (agendada e manual)
+parar_agendador = Event()
+
+
+def versao_banco_trivy() -> str | None:
+    """Retorna a data de atualização do banco de vulnerabilidades do Trivy, usada como sua versão.
+
+    Returns:
+        O campo `VulnerabilityDB.UpdatedAt` de `trivy version`, ou None se não
+        puder ser obtido.
+    """
+    resultado = subprocess.run(
+        ["trivy", "version", "--format", "json"], capture_output=True, text=True, check=False
+    )
+    if resultado.returncode != 0:
+        logging.error("Erro ao consultar a versão do banco do Trivy: %s", resultado.stderr)
+        return None
+    try:
+        return (json.loads(resultado.stdout).get("VulnerabilityDB") or {}).get("UpdatedAt")
+    except json.JSONDecodeError:
+        return None
+
+
+def guardar_sbom(trivy_full_report: dict, output_file_path: str):
+    """Converte o relatório do Trivy em um SBOM CycloneDX e o guarda para reavaliações.
+
+    O SBOM é gravado comprimido na coleção `SBOMS`, junto com as CVEs já
+    analisadas da imagem e a versão do banco do Trivy usada na varredura. Se
+    alguma CVE do relatório não foi armazenada (erro no NVD ou na IA), a
+    versão fica vazia, para que a próxima reavaliação a analise.
+
+    Args:
+        trivy_full_report: O dicionário completo do relatório de análise Trivy,
+            gerado com `--list-all-pkgs`.
+        output_file_path: O caminho do arquivo do relatório Trivy.
+    """
+    collection_name = (
+        trivy_full_report["ArtifactName"].replace("/", "_").replace(":", "_")
+    )
+    sbom_file = output_file_path.removesuffix(".json") + ".cdx.json"
+    resultado = subprocess.run(
+        ["trivy", "convert", "--format", "cyclonedx", "--output", sbom_file, output_file_path],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if resultado.returncode != 0:
+        logging.error("Erro ao gerar o SBOM de '%s': %s", collection_name, resultado.stderr)
+        return
+
+    with open(sbom_file, "rb") as f:
+        sbom = f.read()
+    os.remove(sbom_file)
+
+    metadata = trivy_full_report.get("Metadata") or {}
+    repo_digests = metadata.get("RepoDigests") or []
+    cve_ids = extrair_ids_vulnerabilidades(trivy_full_report)
+    conhecidas = cves_armazenadas(collection_name, cve_ids)
+    agora = datetime.now(timezone.utc)
+    db[SBOMS].replace_one(
+        {"_id": collection_name},
+        {
+            "imagem": trivy_full_report["ArtifactName"],
+            "digest": repo_digests[0] if repo_digests else metadata.get("ImageID"),
+            "base": identificar_camada_base(trivy_full_report),
+            "sbom_zlib": Binary(zlib.compress(sbom)),
+            "cves": sorted(conhecidas),
+            "versao_db": versao_banco_trivy() if conhecidas == set(cve_ids) else None,
+            "atualizado_em": agora,
+            "reavaliado_em": agora,
+        },
+        upsert=True,
+    )
+    logging.info("SBOM de '%s' armazenado (%d bytes).", collection_name, len(sbom))
+
+
+def analisar_cves_novas(
+    backend: dict,
+    imagem: str,
+    collection_name: str,
+    cves_para_analise: list,
+    pacotes_por_cve: dict,
+    base: dict | None,
+    cves_base: set,
+):
+    """Analisa com um backend as CVEs que surgiram na reavaliação do SBOM de uma imagem."""
+    varredura = nova_varredura(collection_name, imagem)
+    analisar_cves_com_backend(
+        backend, collection_name, cves_para_analise, pacotes_por_cve, varredura, base, cves_base
+    )
+
+
+def cves_armazenadas(collection_name: str, cve_ids: list) -> set:
+    """Filtra as CVEs que já têm documento gravado na coleção por todos os backends.
+
+    Args:
+        collection_name: O nome da coleção da imagem.
+        cve_ids: Os IDs das CVEs a verificar.
+
+    Returns:
+        O conjunto das CVEs analisadas e armazenadas por todos os backends de IA.
+    """
+    armazenadas = set(cve_ids)
+    for backend in BACKENDS_IA:
+        filtro = {"cve.id": {"$in": list(armazenadas)}}
+        if backend["nome"]:
+            filtro["modelo"] = backend["nome"]
+        armazenadas &= set(db[collection_name].distinct("cve.id", filtro))
+    return armazenadas
+
+
+def reavaliar_sbom(registro: dict, versao_db: str | None) -> int:
+    """Confronta o SBOM guardado de uma imagem com o banco atual do Trivy.
+
+    Não há download da imagem nem execução de contêiner: o Trivy analisa apenas
+    o inventário de pacotes. O índice de CVEs é atualizado e somente as CVEs
+    que não eram conhecidas passam pelas etapas do NVD e da IA. As CVEs novas
+    que não puderam ser detalhadas ou armazenadas (erro no NVD ou em um
+    backend) continuam desconhecidas e são tentadas de novo na próxima reavaliação.
+
+    Args:
+        registro: O documento da imagem na coleção `SBOMS`.
+        versao_db: A versão atual do banco do Trivy.
+
+    Returns:
+        A quantidade de CVEs novas encontradas.
+    """
+    collection_name = registro["_id"]
+    definir_contexto_log(imagem=registro["imagem"], varredura=None, etapa="reavaliacao")
+    with tempfile.NamedTemporaryFile("wb", suffix=".cdx.json", delete=False) as f:
+        f.write(zlib.decompress(registro["sbom_zlib"]))
+        sbom_file = f.name
+    try:
+        with trava_trivy:
+            resultado = subprocess.run(
+                ["trivy", "sbom", "--format", "json", "--skip-db-update", sbom_file],
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+    finally:
+        os.remove(sbom_file)
+    if resultado.returncode != 0:
+        logging.error("Erro na reavaliação do SBOM de '%s': %s", collection_name, resultado.stderr)
+        return 0
+
+    # O Trivy identifica o artefato pelo caminho do arquivo; restaura o nome e o digest da imagem.
+    relatorio = json.loads(resultado.stdout)
+    relatorio["ArtifactName"] = registro["imagem"]
+    if registro.get("digest"):
+        relatorio.setdefault("Metadata", {})["RepoDigests"] = [registro["digest"]]
+
+    pacotes_por_cve = extrair_pacotes_por_cve(relatorio)
+    atualizar_indice_cves(collection_name, relatorio, pacotes_por_cve)
+
+    cve_ids = extrair_ids_vulnerabilidades(relatorio)
+    conhecidas = set(registro.get("cves") or [])
+    novas = sorted(set(cve_ids) - conhecidas)
+    if novas:
+        logging.info("%d CVEs novas na reavaliação do SBOM de '%s'.", len(novas), collection_name)
+        base = registro.get("base") if DEDUPLICAR_CAMADA_BASE else None
+        cves_base = cves_da_camada_base(pacotes_por_cve, base)
+        executar_nos_backends(
+            analisar_cves_novas,
+            collection_name,
+            registro["imagem"],
+            collection_name,
+            detalhar_cves(novas, base, cves_base),
+            pacotes_por_cve,
+            base,
+            cves_base,
+        )
+    pendentes = set(novas) - cves_armazenadas(collection_name, novas) if novas else set()
+    if pendentes:
+        # Sem a versão do banco, o SBOM volta a ser reavaliado na próxima execução.
+        logging.warning(
+            "%d CVEs novas de '%s' não foram analisadas; serão tentadas na próxima reavaliação.",
+            len(pendentes),
+            collection_name,
+        )
+        versao_db = None
+
+    db[SBOMS].update_one(
+        {"_id": collection_name},
+        {
+            "$set": {
+                "cves": sorted(set(cve_ids) - pendentes),
+                "versao_db": versao_db,
+                "reavaliado_em": datetime.now(timezone.utc),
+            }
+        },
+    )
+    return len(novas)
+
+
+def reavaliar_sboms() -> dict | None:
+    """Atualiza o banco do Trivy e reavalia os SBOMs ainda não confrontados com a versão atual.
+
+    Returns:
+        Um dicionário com a versão do banco, os SBOMs reavaliados e as CVEs
+        novas, ou None se outra reavaliação já estiver em andamento.
+    """
+    if not reavaliacao_em_andamento.acquire(blocking=False):
+        logging.info("Reavaliação dos SBOMs já em andamento.")
+        return None
+    try:
+        with trava_trivy:
+            atualizacao = subprocess.run(
+                ["trivy", "image", "--download-db-only"], capture_output=True, text=True, check=False
+            )
+        if atualizacao.returncode != 0:
+            logging.error("Erro ao atualizar o banco do Trivy: %s", atualizacao.stderr)
+        versao_db = versao_banco_trivy()
+
+        # Sem a versão do banco, todos os SBOMs são reavaliados.
+        filtro = {"versao_db": {"$ne": versao_db}} if versao_db else {}
+        sboms = cves_novas = 0
+        for registro in db[SBOMS].find(filtro):
+            try:
+                cves_novas += reavaliar_sbom(registro, versao_db)
+                sboms += 1
+            except Exception as e:
+                logging.error("Erro inesperado ao reavaliar o SBOM de '%s': %s", registro["_id"], e)
+
+        logging.info(
+            "Reavaliação concluída: %d SBOMs, %d CVEs novas (banco do Trivy: %s).", sboms, cves_novas, versao_db
+        )
+        return {"versao_db": versao_db, "sboms": sboms, "cves_novas": cves_novas}
+    finally:
+        reavaliacao_em_andamento.release()
+
+
+@app.post("/reavaliar-sboms")
+def iniciar_reavaliacao_sboms():
+    """Inicia em segundo plano a reavaliação dos SBOMs guardados.
+
+    Returns:
+        Um JSON informando se a reavaliação foi iniciada.
+    """
+    if reavaliacao_em_andamento.locked():
+        return {"message": "Reavaliação dos SBOMs já em andamento."}
+    Thread(target=reavaliar_sboms, daemon=True).start()
+    return {"message": "Reavaliação dos SBOMs iniciada."}
+
+
+@app.on_event("startup")
+def agendar_reavaliacao_sboms():
+    """Inicia a thread que reavalia os SBOMs periodicamente, após atualizar o banco do Trivy."""
+    if REAVALIACAO_SBOM_HORAS <= 0:
+        return
+
+    def agendador():
+        while not parar_agendador.wait(REAVALIACAO_SBOM_HORAS * 3600):
+            reavaliar_sboms()
+
+    Thread(target=agendador, daemon=True, name="reavaliacao-sboms").start()
+    logging.info("Reavaliação dos SBOMs agendada a cada %s horas.", REAVALIACAO_SBOM_HORAS)
+
+
+@app.on_event("shutdown")
+def parar_reavaliacao_sboms():
+    """Encerra a thread de reavaliação periódica dos SBOMs."""
+    parar_agendador.set()
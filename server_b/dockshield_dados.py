@@ -0,0 +1,277 @@
+import argparse
+import configparser
+import gzip
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pymongo
+from bson import json_util
+
+# ================================================== #
+# SEÇÃO 1: CONFIGURAÇÕES
+# ================================================== #
+
+# ========== Arquivo De Configurações ========== #
+CONFIG_FILE = (
+    "/etc/dockshield/ai_config.ini"
+)
+config = configparser.ConfigParser()
+config.read(CONFIG_FILE)
+
+BANCO = "DockShield"
+VARREDURAS = "_varreduras"  # Versão de cada coleção de imagem, usada pela interface web (ETag)
+
+# ========== Leitura E Escrita Em Fluxo ========== #
+TAMANHO_BLOCO = 1 << 16  # Caracteres lidos por vez dos arquivos de entrada
+TAMANHO_LOTE = 1000  # Documentos por insert_many
+EXTENSOES = (".gz", ".ndjson", ".jsonl", ".json")
+
+# Mantém os tipos do MongoDB ($oid, $date, $binary...) no mesmo formato do mongoexport
+OPCOES_JSON = json_util.RELAXED_JSON_OPTIONS
+decodificador = json.JSONDecoder(object_hook=json_util.object_hook)
+
+
+# ================================================== #
+# SEÇÃO 2: FUNÇÕES
+# ================================================== #
+def abrir_arquivo(caminho: str, modo: str):
+    """Abre um arquivo de texto UTF-8, com compressão gzip se o nome terminar em '.gz'.
+
+    Args:
+        caminho: O caminho do arquivo.
+        modo: "rt" para leitura ou "wt" para escrita.
+
+    Returns:
+        O objeto de arquivo aberto.
+    """
+    if caminho.endswith(".gz"):
+        # Nível 6: quase a mesma compressão do 9, em bem menos tempo
+        return gzip.open(caminho, modo, encoding="utf-8", compresslevel=6)
+    return open(caminho, modo, encoding="utf-8")
+
+
+def nome_colecao(caminho: str) -> str:
+    """Deduz o nome da coleção a partir do nome do arquivo.
+
+    Exemplo: "DockShield.mongo_4.4_DeepSeek.json" -> "mongo_4.4_DeepSeek".
+
+    Args:
+        caminho: O caminho do arquivo exportado.
+
+    Returns:
+        O nome da coleção.
+    """
+    nome = os.path.basename(caminho)
+    for extensao in EXTENSOES:
+        nome = nome.removesuffix(extensao)
+    return nome.removeprefix(f"{BANCO}.")
+
+
+def ler_documentos(caminho: str):
+    """Lê os documentos de um arquivo em fluxo, sem carregá-lo inteiro na memória.
+
+    Aceita tanto um array JSON (formato padrão do `mongoexport --jsonArray` e dos
+    arquivos de `data_samples/`) quanto um documento por linha (NDJSON), com ou
+    sem compressão gzip. O formato é detectado pelo primeiro caractere.
+
+    Args:
+        caminho: O caminho do arquivo.
+
+    Yields:
+        Cada documento, com os tipos estendidos do MongoDB ($oid, $date...) convertidos.
+    """
+    with abrir_arquivo(caminho, "rt") as arquivo:
+        buffer = arquivo.read(TAMANHO_BLOCO).lstrip()
+        em_array = buffer.startswith("[")
+        if em_array:
+            buffer = buffer[1:]
+        separadores = " \t\r\n," if em_array else " \t\r\n"
+
+        posicao = 0
+        while True:
+            # Pula espaços (e vírgulas, no array) até o início do próximo documento
+            while posicao < len(buffer) and buffer[posicao] in separadores:
+                posicao += 1
+            if posicao == len(buffer):
+                buffer, posicao = arquivo.read(TAMANHO_BLOCO), 0
+                if not buffer:
+                    return
+                continue
+            if em_array and buffer[posicao] == "]":
+                return
+
+            try:
+                documento, posicao_final = decodificador.raw_decode(buffer, posicao)
+            except json.JSONDecodeError:
+                # Documento incompleto no buffer: lê mais. O bloco cresce junto com o buffer
+                # para que documentos grandes não sejam decodificados repetidas vezes.
+                bloco = arquivo.read(max(TAMANHO_BLOCO, len(buffer) - posicao))
+                if not bloco:
+                    raise
+                buffer, posicao = buffer[posicao:] + bloco, 0
+                continue
+
+            yield documento
+            posicao = posicao_final
+            # Descarta o que já foi lido para manter a memória constante
+            if posicao > TAMANHO_BLOCO:
+                buffer, posicao = buffer[posicao:], 0
+
+
+def exportar_colecao(db, colecao: str, destino: str, comprimir: bool) -> tuple:
+    """Exporta uma coleção para um arquivo NDJSON, um documento por linha.
+
+    Args:
+        db: O banco de dados MongoDB.
+        colecao: O nome da coleção.
+        destino: O diretório de saída.
+        comprimir: Se True, grava o arquivo com gzip ('.ndjson.gz').
+
+    Returns:
+        Uma tupla (caminho do arquivo, documentos exportados).
+    """
+    caminho = os.path.join(destino, f"{BANCO}.{colecao}.ndjson" + (".gz" if comprimir else ""))
+    total = 0
+    with abrir_arquivo(caminho, "wt") as arquivo:
+        for documento in db[colecao].find(batch_size=TAMANHO_LOTE):
+            arquivo.write(json_util.dumps(documento, json_options=OPCOES_JSON))
+            arquivo.write("\n")
+            total += 1
+    return caminho, total
+
+
+def importar_arquivo(db, caminho: str, colecao: str, substituir: bool, tamanho_lote: int) -> tuple:
+    """Importa um arquivo para uma coleção em lotes de inserções não ordenadas.
+
+    Documentos cujo _id já existe na coleção são ignorados, então a importação
+    pode ser repetida sem duplicar dados.
+
+    Args:
+        db: O banco de dados MongoDB.
+        caminho: O caminho do arquivo (array JSON ou NDJSON, com ou sem gzip).
+        colecao: O nome da coleção de destino.
+        substituir: Se True, apaga a coleção antes de importar.
+        tamanho_lote: Documentos por insert_many.
+
+    Returns:
+        Uma tupla (coleção, documentos inseridos, documentos já existentes).
+    """
+    if substituir:
+        db.drop_collection(colecao)
+
+    inseridos = existentes = 0
+    lote = []
+
+    def gravar_lote():
+        nonlocal inseridos, existentes
+        try:
+            inseridos += len(db[colecao].insert_many(lote, ordered=False).inserted_ids)
+        except pymongo.errors.BulkWriteError as e:
+            erros = e.details.get("writeErrors", [])
+            # Apenas _id duplicado (código 11000) é esperado; outros erros interrompem a importação
+            if any(erro.get("code") != 11000 for erro in erros):
+                raise
+            inseridos += e.details.get("nInserted", 0)
+            existentes += len(erros)
+        lote.clear()
+
+    for documento in ler_documentos(caminho):
+        lote.append(documento)
+        if len(lote) >= tamanho_lote:
+            gravar_lote()
+    if lote:
+        gravar_lote()
+
+    # Coleções de imagens importadas mudam de versão, para que a interface web não sirva dados em cache
+    if not colecao.startswith("_"):
+        db[VARREDURAS].update_one(
+            {"_id": colecao},
+            {"$inc": {"versao": 1}, "$set": {"atualizado_em": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+    return colecao, inseridos, existentes
+
+
+def exportar(args, db):
+    """Executa o comando 'exportar', com várias coleções em paralelo."""
+    colecoes = args.colecoes or sorted(db.list_collection_names())
+    if args.sem_auxiliares:
+        colecoes = [colecao for colecao in colecoes if not colecao.startswith("_")]
+    os.makedirs(args.destino, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=args.paralelo) as executor:
+        futuros = [
+            executor.submit(exportar_colecao, db, colecao, args.destino, args.gzip)
+            for colecao in colecoes
+        ]
+        for futuro in futuros:
+            caminho, total = futuro.result()
+            print(f"{total} documentos exportados para {caminho}")
+
+
+def importar(args, db):
+    """Executa o comando 'importar', com vários arquivos em paralelo."""
+    if args.colecao and len(args.arquivos) > 1:
+        sys.exit("--colecao só pode ser usado com um único arquivo.")
+
+    with ThreadPoolExecutor(max_workers=args.paralelo) as executor:
+        futuros = [
+            executor.submit(
+                importar_arquivo,
+                db,
+                caminho,
+                args.colecao or nome_colecao(caminho),
+                args.substituir,
+                args.lote,
+            )
+            for caminho in args.arquivos
+        ]
+        for futuro in futuros:
+            colecao, inseridos, existentes = futuro.result()
+            print(f"'{colecao}': {inseridos} documentos inseridos, {existentes} já existentes")
+
+    print(
+        "As análises importadas não passam pelos índices da API; para incluí-las na busca "
+        "textual, envie uma requisição POST para /reindexar-busca."
+    )
+
+
+# ================================================== #
+# SEÇÃO 3: INÍCIO DO PROGRAMA
+# ================================================== #
+if __name__ == "__main__":
+    uri_padrao = None
+    if "DATABASE" in config:
+        uri_padrao = f"mongodb://{config['DATABASE']['location']}:{config['DATABASE']['port']}/"
+
+    parser = argparse.ArgumentParser(
+        description="Exporta e importa as coleções do DockShield em fluxo (NDJSON, opcionalmente com gzip)."
+    )
+    parser.add_argument("--uri", default=uri_padrao, help="URI do MongoDB (padrão: seção [DATABASE] do ai_config.ini)")
+    parser.add_argument("-p", "--paralelo", type=int, default=4, help="Coleções processadas ao mesmo tempo")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    parser_exportar = comandos.add_parser("exportar", help="Exporta coleções para arquivos NDJSON")
+    parser_exportar.add_argument("colecoes", nargs="*", help="Coleções a exportar (padrão: todas)")
+    parser_exportar.add_argument("-d", "--destino", default=".", help="Diretório de saída")
+    parser_exportar.add_argument("--gzip", action="store_true", help="Comprime os arquivos (.ndjson.gz)")
+    parser_exportar.add_argument("--sem-auxiliares", action="store_true", help="Ignora as coleções iniciadas por '_'")
+
+    parser_importar = comandos.add_parser("importar", help="Importa arquivos NDJSON ou arrays do mongoexport")
+    parser_importar.add_argument("arquivos", nargs="+", help="Arquivos a importar (.json, .ndjson, com ou sem .gz)")
+    parser_importar.add_argument("-c", "--colecao", help="Coleção de destino (padrão: deduzida do nome do arquivo)")
+    parser_importar.add_argument("--lote", type=int, default=TAMANHO_LOTE, help="Documentos por inserção")
+    parser_importar.add_argument("--substituir", action="store_true", help="Apaga a coleção antes de importar")
+
+    args = parser.parse_args()
+    if not args.uri:
+        sys.exit(f"Informe --uri ou configure a seção [DATABASE] em {CONFIG_FILE}.")
+
+    db = pymongo.MongoClient(args.uri)[BANCO]
+    if args.comando == "exportar":
+        exportar(args, db)
+    else:
+        importar(args, db)
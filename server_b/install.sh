@@ -34,6 +34,7 @@ echo "Movendo arquivos para $BASE_DIR..."
 sudo cp dockshield.service "$BASE_DIR/"        # Arquivo de configuração do systemd
 sudo cp ai.py "$BASE_DIR/"                         # Script Python principal
 sudo cp api.py "$BASE_DIR/"                        # Script Python da API
+sudo cp dockshield_dados.py "$BASE_DIR/"           # Ferramenta de exportação/importação dos dados
 sudo cp dockshield_start.sh "$BASE_DIR/bin/"    # Script shell de inicialização
 sudo cp ai_config.ini "$BASE_DIR/config/"          # Arquivo de configuração da aplicação
 
@@ -42,6 +43,7 @@ echo "Ajustando permissões..."
 sudo chmod 644 "$BASE_DIR/dockshield.service"     # Permissão padrão para o systemd
 sudo chmod 755 "$BASE_DIR/ai.py"                     # Executável
 sudo chmod 755 "$BASE_DIR/api.py"                    # Executável
+sudo chmod 755 "$BASE_DIR/dockshield_dados.py"       # Executável
 sudo chmod 755 "$BASE_DIR/bin/dockshield_start.sh" # Executável
 sudo chmod 644 "$BASE_DIR/config/ai_config.ini"      # Somente leitura
 
@@ -1,7 +1,13 @@
+import gzip
+import hashlib
+import json
 import os
+import zlib
+from datetime import timezone
+
 import markdown
 from bson import ObjectId
-from flask import Flask, redirect, render_template, request, url_for
+from flask import Flask, jsonify, redirect, render_template, request, url_for
 from pymongo import MongoClient
 
 # ================================================== #
@@ -10,6 +16,15 @@ from pymongo import MongoClient
 
 app = Flask(__name__)
 CVES_POR_PAGINA = 100
+RESULTADOS_BUSCA_POR_PAGINA = 20
+TAMANHO_MINIMO_GZIP = 1024  # Respostas da API menores que isso não compensam a compressão
+
+# Coleções auxiliares mantidas pelo server_b (começam com "_" e não são imagens)
+INDICE_CVES = "_indice_cves"
+BUSCA = "_busca"
+VARREDURAS = "_varreduras"
+BASES = "_bases"
+BASES_CVES = "_bases_cves"
 
 # ========== Conexão com Banco de Dados ========== #
 try:
@@ -20,6 +35,129 @@ try:
 except Exception:
     db = None
 
+# Endereço do server_b, de onde a página ao vivo recebe os eventos de progresso (ex: http://192.168.0.2:8000)
+URL_SERVER_B = "http://localhost:8000"
+
+# ========== Documentos Compactados ========== #
+def _mesclar(base, sobreposicao):
+    """Mescla recursivamente dicionários e listas (por posição), priorizando a sobreposição."""
+    if isinstance(base, dict) and isinstance(sobreposicao, dict):
+        for chave, valor in sobreposicao.items():
+            base[chave] = _mesclar(base.get(chave), valor)
+        return base
+    if isinstance(base, list) and isinstance(sobreposicao, list):
+        for indice, valor in enumerate(sobreposicao):
+            if indice < len(base):
+                base[indice] = _mesclar(base[indice], valor)
+            else:
+                base.append(valor)
+        return base
+    return sobreposicao
+
+
+def expandir_documento(documento):
+    """Reconstrói um documento gravado pelo server_b no modo de armazenamento compacto.
+
+    No modo compacto, parte de cada campo ('cve', 'relatorio' e
+    'analise_do_container') é gravada como JSON comprimido em '<campo>_zlib'.
+    Esta função descomprime esses blobs e os mescla aos campos simples,
+    devolvendo o documento no mesmo formato do modo completo.
+
+    Args:
+        documento (dict): O documento como lido do MongoDB.
+
+    Returns:
+        dict: O documento expandido (documentos no modo completo não mudam).
+    """
+    for campo in ("cve", "relatorio", "analise_do_container"):
+        blob = documento.pop(f"{campo}_zlib", None)
+        if blob is not None:
+            comprimido = json.loads(zlib.decompress(blob).decode("utf-8"))
+            documento[campo] = _mesclar(comprimido, documento.get(campo))
+
+    # CVEs da camada base compartilhada guardam apenas uma referência aos detalhes
+    # do NVD e ao relatório; os detalhes guardados na base têm prioridade
+    referencia = documento.pop("relatorio_ref", None)
+    if referencia:
+        compartilhado = db[BASES_CVES].find_one(
+            {"_id": referencia["base"]},
+            {"cve": True, "cve_zlib": True, f"relatorios.{referencia['modelo']}": True},
+        ) or {}
+        relatorio = (compartilhado.pop("relatorios", None) or {}).get(referencia["modelo"])
+        if relatorio:
+            documento["relatorio"] = expandir_documento(relatorio)["relatorio"]
+        detalhes = expandir_documento(compartilhado).get("cve")
+        if detalhes:
+            documento["cve"] = _mesclar(documento.get("cve") or [], detalhes)
+    return documento
+
+
+def analise_base(doc_analise_imagem):
+    """Busca o resumo da camada base (SO) referenciado pela análise de uma imagem.
+
+    Imagens construídas sobre a mesma base compartilham um único resumo da
+    base, gravado pelo server_b na coleção '_bases'.
+
+    Args:
+        doc_analise_imagem (dict): O documento com 'analise_do_container'.
+
+    Returns:
+        dict: O documento da base expandido (com 'os' e 'analise_do_container'),
+              ou None se a análise não referenciar uma base.
+    """
+    if not doc_analise_imagem.get("base"):
+        return None
+    doc_base = db[BASES].find_one({"_id": doc_analise_imagem["base"]})
+    return expandir_documento(doc_base) if doc_base else None
+
+
+def modelos_colecao(colecao):
+    """Lista os modelos de IA com resultados em uma coleção (modo com vários modelos).
+
+    Args:
+        colecao (str): O nome da coleção da imagem.
+
+    Returns:
+        list: Os nomes dos modelos em ordem alfabética, ou lista vazia se a
+              imagem foi analisada por um único modelo.
+    """
+    registro = db[VARREDURAS].find_one({"_id": colecao}, {"modelos": True}) or {}
+    return sorted(registro.get("modelos", []))
+
+
+def conteudo_resposta_ia(resposta):
+    """Extrai o relatório (Markdown) de uma resposta da IA.
+
+    Args:
+        resposta (dict): A resposta da IA, como armazenada no documento.
+
+    Returns:
+        str: O conteúdo do relatório, ou None se a estrutura for inesperada
+             (ex: uma resposta de erro, sem 'choices').
+    """
+    try:
+        conteudo = resposta["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return conteudo if isinstance(conteudo, str) else None
+
+
+def markdown_resposta_ia(resposta, mensagem_erro):
+    """Converte para HTML o relatório (Markdown) de uma resposta da IA.
+
+    Args:
+        resposta (dict): A resposta da IA, como armazenada no documento.
+        mensagem_erro (str): O HTML exibido se a estrutura for inesperada.
+
+    Returns:
+        str: O relatório em HTML.
+    """
+    conteudo = conteudo_resposta_ia(resposta)
+    if conteudo is None:
+        return mensagem_erro
+    return markdown.markdown(conteudo)
+
+
 # ================================================== #
 # SEÇÃO 2: ROTAS DO APLICATIVO
 # ================================================== #
@@ -40,6 +178,8 @@ def index():
     """
     # Obtém nomes das coleções; retorna lista vazia se 'db' for None
     colecoes = db.list_collection_names() if db is not None else []
+    # Ignora as coleções auxiliares (ex: índice de CVEs), que não representam imagens
+    colecoes = [colecao for colecao in colecoes if not colecao.startswith("_")]
     return render_template("index.html", colecoes=colecoes)
 
 
@@ -48,10 +188,12 @@ def index():
 def docker_details(colecao):
     """Exibe o relatório de análise principal de uma imagem (coleção).
 
-    Busca na coleção especificada por um documento único que contém o
-    relatório de análise da imagem (identificado pela chave
-    'analise_do_container'). O conteúdo (Markdown) desse relatório é
-    extraído, convertido para HTML e exibido.
+    Busca na coleção especificada pelos documentos que contêm o relatório
+    de análise da imagem (identificados pela chave 'analise_do_container').
+    O conteúdo (Markdown) do relatório mais recente de cada modelo de IA é
+    extraído, convertido para HTML e exibido, lado a lado quando a imagem
+    foi analisada por vários modelos. Quando a análise referencia uma camada
+    base compartilhada, o resumo da base é exibido junto.
 
     Args:
         colecao (str): O nome da coleção do MongoDB a ser consultada.
@@ -63,21 +205,37 @@ def docker_details(colecao):
     """
     if db is None:
         return "<p>Banco de dados não disponível.</p>"
-
-    # Busca o documento específico que contém o relatório geral da imagem
-    doc_analise_imagem = db[colecao].find_one({"analise_do_container": {"$exists": True}})
-    analise_imagem_html = None
-
-    if doc_analise_imagem:
-        try:
-            # Extrai o relatório (Markdown) de dentro da estrutura de resposta da IA
-            content_markdown = doc_analise_imagem["analise_do_container"]["choices"][0]["message"]["content"]
-            analise_imagem_html = markdown.markdown(content_markdown)
-        except Exception:
-            # Falha se a estrutura do documento for inesperada
-            analise_imagem_html = "<p>Erro ao carregar o relatório de análise da imagem.</p>"
-
-    return render_template("docker.html", colecao=colecao, analise_imagem_html=analise_imagem_html)
+    
+    # Busca os documentos com o relatório geral da imagem, do mais recente ao mais antigo
+    docs_analise_imagem = db[colecao].find({"analise_do_container": {"$exists": True}}).sort("_id", -1)
+    analises = {}
+
+    for doc_analise_imagem in docs_analise_imagem:
+        modelo = doc_analise_imagem.get("modelo")
+        if modelo in analises:
+            continue  # Mantém apenas o relatório mais recente de cada modelo
+        expandir_documento(doc_analise_imagem)
+        # Extrai o relatório (Markdown) de dentro da estrutura de resposta da IA
+        analises[modelo] = {
+            "modelo": modelo,
+            "html": markdown_resposta_ia(
+                doc_analise_imagem["analise_do_container"],
+                "<p>Erro ao carregar o relatório de análise da imagem.</p>",
+            ),
+        }
+        # Resumo da camada base (SO), compartilhado com as imagens construídas sobre ela
+        doc_base = analise_base(doc_analise_imagem)
+        if doc_base:
+            analises[modelo]["base"] = {
+                "os": doc_base.get("os"),
+                "html": markdown_resposta_ia(
+                    doc_base["analise_do_container"],
+                    "<p>Erro ao carregar o relatório de análise da camada base.</p>",
+                ),
+            }
+
+    analises = [analises[modelo] for modelo in sorted(analises, key=lambda m: m or "")]
+    return render_template("docker.html", colecao=colecao, analises=analises, modelos=modelos_colecao(colecao))
 
 
 # ========== Rota da Lista de CVEs (Paginada) ========== #
@@ -87,7 +245,9 @@ def cve_list(colecao):
 
     Consulta a coleção em busca de todos os documentos que contêm dados
     de CVE (identificados pela chave 'cve'). Implementa a paginação
-    com base no parâmetro 'page' da URL.
+    com base no parâmetro 'page' da URL. Quando a imagem foi analisada
+    por vários modelos, lista as CVEs do modelo do parâmetro 'modelo'
+    (por padrão, o primeiro em ordem alfabética).
 
     Args:
         colecao (str): O nome da coleção do MongoDB a ser consultada.
@@ -100,13 +260,18 @@ def cve_list(colecao):
     """
     if db is None:
         return "<p>Banco de dados não disponível.</p>"
-
     # Calcula a paginação: obtém a página atual (skip) e o número total de páginas.
     page = request.args.get("page", 1, type=int)
     skip = (page - 1) * CVES_POR_PAGINA
 
+    # Seleciona o modelo cujas CVEs serão listadas (apenas no modo com vários modelos).
+    modelos = modelos_colecao(colecao)
+    modelo = request.args.get("modelo") or (modelos[0] if modelos else None)
+
     # Conta o total de CVEs e calcula o número de páginas necessárias para a paginação.
     query_cve = {"cve": {"$exists": True}}
+    if modelo:
+        query_cve["modelo"] = modelo
     total_cves = db[colecao].count_documents(query_cve)
     total_pages = (total_cves + CVES_POR_PAGINA - 1) // CVES_POR_PAGINA if CVES_POR_PAGINA > 0 else 0
 
@@ -122,6 +287,8 @@ def cve_list(colecao):
         page=page,
         total_pages=total_pages,
         total_cves=total_cves,
+        modelos=modelos,
+        modelo=modelo,
     )
 
 
@@ -132,7 +299,8 @@ def resumo(colecao, id):
 
     Busca um documento específico em uma coleção usando seu '_id'.
     Se encontrado, extrai o relatório (Markdown), converte-o para HTML
-    e o exibe na página de relatório.
+    e o exibe na página de relatório. Se a mesma CVE foi analisada por
+    outros modelos de IA, os relatórios são exibidos lado a lado.
 
     Args:
         colecao (str): O nome da coleção do MongoDB.
@@ -158,20 +326,526 @@ def resumo(colecao, id):
     doc = db[colecao].find_one({"_id": object_id_instance})
 
     if doc:
+        expandir_documento(doc)
         doc["_id"] = str(doc["_id"])
         doc["colecao"] = colecao
-        try:
-            # Extrai o relatório (Markdown) da estrutura de resposta da IA
-            content_markdown = doc["relatorio"]["choices"][0]["message"]["content"]
-            content_html = markdown.markdown(content_markdown)
-        except Exception:
-            content_html = "<p>Erro ao carregar o conteúdo do relatório.</p>"
-
-        return render_template("relatorio.html", doc=doc, content_html=content_html, colecao=colecao)
+        # Extrai o relatório (Markdown) da estrutura de resposta da IA
+        erro_relatorio = "<p>Erro ao carregar o conteúdo do relatório.</p>"
+        relatorios = [{"modelo": doc.get("modelo"), "html": markdown_resposta_ia(doc["relatorio"], erro_relatorio)}]
+
+        # No modo com vários modelos, inclui o relatório mais recente da mesma CVE feito por cada outro modelo.
+        if doc.get("modelo"):
+            outros_docs = db[colecao].find(
+                {"cve.id": doc["cve"][0]["id"], "modelo": {"$ne": doc["modelo"]}}
+            ).sort("_id", -1)
+            modelos_incluidos = {doc["modelo"]}
+            for outro in outros_docs:
+                if outro["modelo"] in modelos_incluidos:
+                    continue
+                modelos_incluidos.add(outro["modelo"])
+                expandir_documento(outro)
+                relatorios.append({"modelo": outro["modelo"], "html": markdown_resposta_ia(outro["relatorio"], erro_relatorio)})
+
+        return render_template("relatorio.html", doc=doc, relatorios=relatorios, colecao=colecao)
 
     # Redireciona se o documento com o ID não for encontrado
     return redirect(url_for("cve_list", colecao=colecao))
 
+# ========== Consulta de Imagens Afetadas ========== #
+def buscar_imagens_afetadas(cve_id=None, pacote=None):
+    """Consulta o índice invertido de CVEs mantido pelo server_b.
+
+    Permite descobrir, com uma única consulta indexada, quais imagens são
+    afetadas por uma CVE ou por um pacote, sem percorrer as coleções de
+    cada imagem.
+
+    Args:
+        cve_id (str): O ID da CVE (ex: "CVE-2022-41723"). Opcional.
+        pacote (str): O nome do pacote afetado (ex: "golang.org/x/net"). Opcional.
+
+    Returns:
+        list: Os documentos do índice (um por par CVE/imagem), sem o '_id'.
+              Retorna lista vazia se nenhum filtro for informado.
+    """
+    filtro = {}
+    if cve_id:
+        filtro["cve"] = cve_id.strip().upper()
+    if pacote:
+        filtro["pacotes.nome"] = pacote.strip()
+    if not filtro:
+        return []
+
+    documentos = db[INDICE_CVES].find(filtro, {"_id": False}).sort([("cve", 1), ("colecao", 1)])
+    return list(documentos)
+
+
+@app.route("/afetadas")
+def imagens_afetadas():
+    """Exibe as imagens afetadas por uma CVE ou por um pacote.
+
+    Os filtros são lidos dos parâmetros 'cve' e 'pacote' da URL.
+
+    Returns:
+        str: A página HTML renderizada (template 'afetadas.html') com as
+             imagens, digests e pacotes afetados. Retorna uma mensagem de
+             erro simples se o DB não estiver acessível.
+    """
+    if db is None:
+        return "<p>Banco de dados não disponível.</p>"
+
+    cve_id = request.args.get("cve", "")
+    pacote = request.args.get("pacote", "")
+    afetadas = buscar_imagens_afetadas(cve_id, pacote)
+    return render_template("afetadas.html", cve_id=cve_id, pacote=pacote, afetadas=afetadas)
+
+
+@app.route("/api/afetadas")
+def api_imagens_afetadas():
+    """Versão JSON da rota '/afetadas', para uso por automações.
+
+    Returns:
+        Response: Um JSON com os filtros usados e a lista de entradas do
+                  índice. Retorna 503 se o DB não estiver acessível e 400
+                  se nenhum filtro for informado.
+    """
+    if db is None:
+        return jsonify({"erro": "Banco de dados não disponível."}), 503
+
+    cve_id = request.args.get("cve", "")
+    pacote = request.args.get("pacote", "")
+    if not cve_id and not pacote:
+        return jsonify({"erro": "Informe o parâmetro 'cve' ou 'pacote'."}), 400
+
+    afetadas = buscar_imagens_afetadas(cve_id, pacote)
+    return jsonify({"cve": cve_id or None, "pacote": pacote or None, "total": len(afetadas), "afetadas": afetadas})
+
+
+# ========== Busca Textual ========== #
+def buscar_texto(termo, imagem=None, severidade=None, page=1):
+    """Executa a busca textual nas descrições do NVD e nos relatórios da IA.
+
+    A busca usa o índice de texto da coleção auxiliar mantida pelo server_b,
+    ordenando os resultados pela relevância calculada pelo MongoDB.
+
+    Args:
+        termo (str): O texto buscado (ex: "HPACK" ou "\"heap overflow\"").
+        imagem (str): Restringe a busca à coleção de uma imagem. Opcional.
+        severidade (str): Restringe a busca a uma severidade (ex: "HIGH"). Opcional.
+        page (int): A página de resultados desejada, começando em 1.
+
+    Returns:
+        tuple: Uma tupla (resultados, total) com os documentos da página atual
+               (com '_id' convertido para string) e o total de resultados.
+    """
+    filtro = {"$text": {"$search": termo}}
+    if imagem:
+        filtro["colecao"] = imagem
+    if severidade:
+        filtro["severidade"] = severidade.upper()
+
+    total = db[BUSCA].count_documents(filtro)
+    skip = (page - 1) * RESULTADOS_BUSCA_POR_PAGINA
+    documentos = (
+        db[BUSCA]
+        .find(filtro, {"relevancia": {"$meta": "textScore"}, "relatorio": False})
+        .sort([("relevancia", {"$meta": "textScore"})])
+        .skip(skip)
+        .limit(RESULTADOS_BUSCA_POR_PAGINA)
+    )
+    resultados = [{**doc, "_id": str(doc["_id"])} for doc in documentos]
+    return resultados, total
+
+
+@app.route("/busca")
+def busca():
+    """Exibe a busca textual paginada sobre CVEs e relatórios da IA.
+
+    Lê o termo ('q'), os filtros ('imagem' e 'severidade') e a página
+    ('page') dos parâmetros da URL.
+
+    Returns:
+        str: A página HTML renderizada (template 'busca.html') com os
+             resultados ordenados por relevância. Retorna uma mensagem de
+             erro simples se o DB não estiver acessível.
+    """
+    if db is None:
+        return "<p>Banco de dados não disponível.</p>"
+
+    termo = request.args.get("q", "").strip()
+    imagem = request.args.get("imagem", "")
+    severidade = request.args.get("severidade", "")
+    page = max(request.args.get("page", 1, type=int), 1)
+
+    resultados, total = buscar_texto(termo, imagem, severidade, page) if termo else ([], 0)
+    total_pages = (total + RESULTADOS_BUSCA_POR_PAGINA - 1) // RESULTADOS_BUSCA_POR_PAGINA
+
+    colecoes = [colecao for colecao in db.list_collection_names() if not colecao.startswith("_")]
+    return render_template(
+        "busca.html",
+        termo=termo,
+        imagem=imagem,
+        severidade=severidade,
+        colecoes=sorted(colecoes),
+        resultados=resultados,
+        page=page,
+        total_pages=total_pages,
+        total=total,
+    )
+
+
+@app.route("/api/busca")
+def api_busca():
+    """Versão JSON da rota '/busca', para uso por automações.
+
+    Returns:
+        Response: Um JSON com os resultados da página atual e os dados de
+                  paginação. Retorna 503 se o DB não estiver acessível e 400
+                  se o termo de busca não for informado.
+    """
+    if db is None:
+        return jsonify({"erro": "Banco de dados não disponível."}), 503
+
+    termo = request.args.get("q", "").strip()
+    if not termo:
+        return jsonify({"erro": "Informe o parâmetro 'q'."}), 400
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    resultados, total = buscar_texto(
+        termo, request.args.get("imagem"), request.args.get("severidade"), page
+    )
+    return jsonify({"q": termo, "page": page, "por_pagina": RESULTADOS_BUSCA_POR_PAGINA, "total": total, "resultados": resultados})
+
+
+# ========== Progresso Ao Vivo ========== #
+@app.route("/ao-vivo")
+def ao_vivo():
+    """Exibe o progresso das análises em andamento, em tempo real.
+
+    A página se conecta diretamente ao endpoint '/eventos' do server_b
+    (Server-Sent Events) e preenche as CVEs de cada imagem à medida que são
+    analisadas e gravadas, com links para os relatórios.
+
+    Returns:
+        str: A página HTML renderizada (template 'ao_vivo.html').
+    """
+    url_eventos = f"{URL_SERVER_B}/eventos" if URL_SERVER_B else None
+    return render_template("ao_vivo.html", url_eventos=url_eventos)
+
+
+# ========== API JSON (v1) ========== #
+def versao_colecao(colecao):
+    """Obtém a versão e a data da última alteração da coleção de uma imagem.
+
+    A versão é mantida pelo server_b a cada documento gravado. Para coleções
+    gravadas antes desse controle, usa o total de documentos e o ObjectId mais
+    recente (que carrega a data de criação) como versão.
+
+    Args:
+        colecao (str): O nome da coleção da imagem.
+
+    Returns:
+        tuple: Uma tupla (versao, ultima_modificacao), onde a versão é uma
+               string e a última modificação é um datetime UTC (ou None).
+    """
+    registro = db[VARREDURAS].find_one({"_id": colecao})
+    if registro:
+        return str(registro["versao"]), registro.get("atualizado_em")
+
+    ultimo = db[colecao].find_one({}, {"_id": True}, sort=[("_id", -1)])
+    if ultimo is None:
+        return "0", None
+    total = db[colecao].estimated_document_count()
+    return f"{total}-{ultimo['_id']}", ultimo["_id"].generation_time
+
+
+def _normalizar_data(ultima_modificacao):
+    """Converte uma data do MongoDB (UTC, sem fuso) para a precisão do HTTP (segundos inteiros)."""
+    if ultima_modificacao is None:
+        return None
+    return ultima_modificacao.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def nao_modificado(etag, ultima_modificacao):
+    """Verifica se a cópia do cliente continua válida, pelo ETag ou pela data.
+
+    Usa o 'If-None-Match' quando enviado; caso contrário, compara o
+    'If-Modified-Since' com a data da última modificação. As rotas chamam esta
+    função antes de consultar o banco, para responder 304 sem ler os dados.
+
+    Args:
+        etag (str): O ETag (fraco) que identifica a versão dos dados.
+        ultima_modificacao (datetime): A data da última alteração dos dados, ou None.
+
+    Returns:
+        bool: True se o cliente pode reutilizar a resposta que já tem.
+    """
+    ultima_modificacao = _normalizar_data(ultima_modificacao)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return (
+        ultima_modificacao is not None
+        and request.if_modified_since is not None
+        and ultima_modificacao <= request.if_modified_since
+    )
+
+
+def resposta_condicional(etag, ultima_modificacao, gerar_dados):
+    """Monta uma resposta JSON com suporte a requisições condicionais.
+
+    Se o cliente enviar um 'If-None-Match' com o ETag atual (ou um
+    'If-Modified-Since' igual ou posterior à última modificação), responde
+    304 sem chamar 'gerar_dados', evitando qualquer consulta adicional ao banco.
+
+    Args:
+        etag (str): O ETag (fraco) que identifica a versão dos dados.
+        ultima_modificacao (datetime): A data da última alteração dos dados, ou None.
+        gerar_dados (callable): Função sem argumentos que retorna os dados da resposta.
+
+    Returns:
+        Response: A resposta 304 ou a resposta JSON com os dados.
+    """
+    ultima_modificacao = _normalizar_data(ultima_modificacao)
+    resposta = app.response_class(status=304) if nao_modificado(etag, ultima_modificacao) else jsonify(gerar_dados())
+    resposta.set_etag(etag, weak=True)
+    if ultima_modificacao is not None:
+        resposta.last_modified = ultima_modificacao
+    # Permite que o cliente guarde a resposta, mas obriga a revalidação a cada uso
+    resposta.cache_control.no_cache = True
+    return resposta
+
+
+def severidade_cve(cve_info):
+    """Obtém a severidade e o score CVSS de um registro do NVD.
+
+    Segue a mesma prioridade da lista de CVEs (v3.1, v3.0 e v2).
+
+    Args:
+        cve_info (dict): O registro da CVE (o item da lista 'cve' do documento).
+
+    Returns:
+        tuple: Uma tupla (severidade, score). Retorna ("UNKNOWN", None) sem métricas.
+    """
+    metrics = cve_info.get("metrics") or {}
+    for chave in ("cvssMetricV31", "cvssMetricV30"):
+        if metrics.get(chave):
+            cvss_data = metrics[chave][0].get("cvssData", {})
+            return cvss_data.get("baseSeverity", "UNKNOWN"), cvss_data.get("baseScore")
+    if metrics.get("cvssMetricV2"):
+        metrica_v2 = metrics["cvssMetricV2"][0]
+        return metrica_v2.get("baseSeverity", "UNKNOWN"), metrica_v2.get("cvssData", {}).get("baseScore")
+    return "UNKNOWN", None
+
+
+@app.route("/api/v1/imagens")
+def api_v1_imagens():
+    """Lista as imagens analisadas com a versão atual de cada coleção.
+
+    Returns:
+        Response: Um JSON com as imagens, ou 304 se nada mudou desde a
+                  última consulta do cliente. Retorna 503 se o DB não
+                  estiver acessível.
+    """
+    if db is None:
+        return jsonify({"erro": "Banco de dados não disponível."}), 503
+
+    colecoes = sorted(c for c in db.list_collection_names() if not c.startswith("_"))
+    registros = {r["_id"]: r for r in db[VARREDURAS].find()}
+
+    # O ETag da lista muda quando uma imagem é adicionada ou qualquer versão é alterada
+    assinatura = "|".join(f"{c}:{registros.get(c, {}).get('versao', 0)}" for c in colecoes)
+    etag = hashlib.sha1(assinatura.encode("utf-8")).hexdigest()
+    datas = [r["atualizado_em"] for r in registros.values() if r.get("atualizado_em")]
+    ultima_modificacao = max(datas) if datas else None
+
+    def gerar_dados():
+        return {
+            "imagens": [
+                {
+                    "colecao": colecao,
+                    "imagem": registros.get(colecao, {}).get("imagem"),
+                    "versao": registros.get(colecao, {}).get("versao"),
+                    "atualizado_em": registros.get(colecao, {}).get("atualizado_em"),
+                }
+                for colecao in colecoes
+            ]
+        }
+
+    return resposta_condicional(etag, ultima_modificacao, gerar_dados)
+
+
+@app.route("/api/v1/imagens/<colecao>")
+def api_v1_imagem(colecao):
+    """Retorna as análises da imagem geradas pela IA (em Markdown), uma por modelo.
+
+    Análises gravadas sem relatório (ex: uma resposta de erro da IA) são
+    retornadas com 'analise' igual a null.
+
+    Args:
+        colecao (str): O nome da coleção da imagem.
+
+    Returns:
+        Response: Um JSON com a análise, ou 304 se nada mudou. Retorna 404
+                  se a imagem não tiver análise e 503 sem DB.
+    """
+    if db is None:
+        return jsonify({"erro": "Banco de dados não disponível."}), 503
+
+    versao, ultima_modificacao = versao_colecao(colecao)
+    # Sem esta verificação, um If-None-Match com a versão "0" receberia 304 para uma imagem inexistente.
+    if versao == "0":
+        return jsonify({"erro": "Análise da imagem não encontrada."}), 404
+    analises = {}
+
+    def gerar_dados():
+        return {"colecao": colecao, "versao": versao, "analises": list(analises.values())}
+
+    etag = f"{colecao}-{versao}"
+    if not nao_modificado(etag, ultima_modificacao):
+        # Mantém o relatório mais recente de cada modelo (vários apenas no modo com vários modelos)
+        for doc_analise_imagem in db[colecao].find({"analise_do_container": {"$exists": True}}).sort("_id", -1):
+            if doc_analise_imagem.get("modelo") in analises:
+                continue
+            analise = expandir_documento(doc_analise_imagem)["analise_do_container"]
+            analises[doc_analise_imagem.get("modelo")] = {
+                "modelo": doc_analise_imagem.get("modelo"),
+                "modelo_ia": analise.get("model"),
+                "analise": conteudo_resposta_ia(analise),
+            }
+            doc_base = analise_base(doc_analise_imagem)
+            if doc_base:
+                analises[doc_analise_imagem.get("modelo")]["base"] = {
+                    "os": doc_base.get("os"),
+                    "diff_id": doc_base.get("diff_id"),
+                    "analise": conteudo_resposta_ia(doc_base["analise_do_container"]),
+                }
+        if not analises:
+            return jsonify({"erro": "Análise da imagem não encontrada."}), 404
+
+    return resposta_condicional(etag, ultima_modificacao, gerar_dados)
+
+
+@app.route("/api/v1/imagens/<colecao>/cves")
+def api_v1_cves(colecao):
+    """Lista paginada das CVEs de uma imagem, com severidade e score.
+
+    A página é lida do parâmetro 'page' da URL e, no modo com vários
+    modelos, o parâmetro opcional 'modelo' restringe as CVEs a um modelo.
+
+    Args:
+        colecao (str): O nome da coleção da imagem.
+
+    Returns:
+        Response: Um JSON com as CVEs da página e os dados de paginação,
+                  ou 304 se nada mudou. Retorna 404 se a imagem não
+                  existir e 503 sem DB.
+    """
+    if db is None:
+        return jsonify({"erro": "Banco de dados não disponível."}), 503
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    modelo = request.args.get("modelo")
+    versao, ultima_modificacao = versao_colecao(colecao)
+    if versao == "0":
+        return jsonify({"erro": "Imagem não encontrada."}), 404
+
+    def gerar_dados():
+        query_cve = {"cve.0": {"$exists": True}}
+        if modelo:
+            query_cve["modelo"] = modelo
+        total_cves = db[colecao].count_documents(query_cve)
+        documentos = (
+            db[colecao]
+            .find(query_cve, {"cve": True, "modelo": True})
+            .skip((page - 1) * CVES_POR_PAGINA)
+            .limit(CVES_POR_PAGINA)
+        )
+        cves = []
+        for doc in documentos:
+            severidade, score = severidade_cve(doc["cve"][0])
+            cves.append({
+                "_id": str(doc["_id"]),
+                "cve": doc["cve"][0]["id"],
+                "modelo": doc.get("modelo"),
+                "severidade": severidade,
+                "score": score,
+            })
+        return {
+            "colecao": colecao,
+            "versao": versao,
+            "page": page,
+            "por_pagina": CVES_POR_PAGINA,
+            "total": total_cves,
+            "cves": cves,
+        }
+
+    return resposta_condicional(f"{colecao}-{versao}-p{page}-{modelo or ''}", ultima_modificacao, gerar_dados)
+
+
+@app.route("/api/v1/imagens/<colecao>/cves/<id>")
+def api_v1_relatorio(colecao, id):
+    """Retorna o documento completo de uma CVE: dados do NVD e relatório da IA.
+
+    Args:
+        colecao (str): O nome da coleção da imagem.
+        id (str): A string do ObjectId do documento.
+
+    Returns:
+        Response: Um JSON com o documento, ou 304 se nada mudou. Retorna
+                  404 se o ID for inválido ou não encontrado e 503 sem DB.
+    """
+    if db is None:
+        return jsonify({"erro": "Banco de dados não disponível."}), 503
+
+    try:
+        object_id_instance = ObjectId(id)
+    except Exception:
+        return jsonify({"erro": "ID inválido."}), 404
+
+    # Documentos de CVE não mudam depois de gravados: o próprio ID serve de ETag.
+    etag = id
+    if nao_modificado(etag, object_id_instance.generation_time):
+        # Para responder 304, basta confirmar que o documento existe (consulta apenas o _id).
+        doc = db[colecao].find_one({"_id": object_id_instance}, {"_id": True})
+    else:
+        doc = db[colecao].find_one({"_id": object_id_instance})
+    if doc is None:
+        return jsonify({"erro": "Documento não encontrado."}), 404
+
+    return resposta_condicional(etag, object_id_instance.generation_time, lambda: {**expandir_documento(doc), "_id": id})
+
+
+@app.after_request
+def comprimir_resposta(resposta):
+    """Comprime com gzip as respostas JSON grandes da API.
+
+    Só comprime respostas das rotas '/api/' com status 200 quando o cliente
+    aceita gzip e o conteúdo ultrapassa 'TAMANHO_MINIMO_GZIP' bytes.
+
+    Args:
+        resposta (Response): A resposta gerada pela rota.
+
+    Returns:
+        Response: A mesma resposta, comprimida quando aplicável.
+    """
+    if (
+        not request.path.startswith("/api/")
+        or resposta.status_code != 200
+        or resposta.direct_passthrough
+        or "Content-Encoding" in resposta.headers
+        or "gzip" not in request.headers.get("Accept-Encoding", "").lower()
+    ):
+        return resposta
+
+    resposta.vary.add("Accept-Encoding")
+    dados = resposta.get_data()
+    if len(dados) < TAMANHO_MINIMO_GZIP:
+        return resposta
+
+    resposta.set_data(gzip.compress(dados, compresslevel=6))
+    resposta.headers["Content-Encoding"] = "gzip"
+    return resposta
+
+
 # ================================================== #
 # SEÇÃO 3: INÍCIO DO PROGRAMA
 # ================================================== #
@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import posixpath
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from urllib.parse import quote
+
+from app import CVES_POR_PAGINA, app, db, modelos_colecao, versao_colecao
+
+# ================================================== #
+# SEÇÃO 1: CONFIGURAÇÕES
+# ================================================== #
+
+# ========== Site Gerado ========== #
+DESTINO_PADRAO = "/var/www/server_web_estatico"
+MANIFESTO = "manifesto.json"  # Versão e arquivos gerados de cada imagem, usado na geração incremental
+PASTA_STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# Folha de estilo carregada pelos templates; com --bootstrap, é trocada por uma cópia local (redes isoladas)
+URL_BOOTSTRAP = "https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css"
+BOOTSTRAP_LOCAL = "static/bootstrap.min.css"
+
+# ========== Estado De Cada Processo ========== #
+destino = None
+bootstrap_local = False
+pagina_atual = "index.html"  # Página em renderização, base dos links relativos
+
+
+# ================================================== #
+# SEÇÃO 2: FUNÇÕES
+# ================================================== #
+
+# ========== Links Do Site Estático ========== #
+def caminho_pagina(endpoint: str, valores: dict):
+    """Converte uma rota do aplicativo no caminho do arquivo correspondente no site.
+
+    As páginas com parâmetros de URL ganham um arquivo próprio (ex: a página 2 da
+    lista de CVEs vira 'cve-list/<colecao>/2.html'), já que o Apache não as
+    diferencia pela query string.
+
+    Args:
+        endpoint: O nome da rota (o mesmo usado no 'url_for' dos templates).
+        valores: Os parâmetros da rota.
+
+    Returns:
+        O caminho relativo à raiz do site, ou None se a rota depende do
+        servidor (busca, imagens afetadas, página ao vivo).
+    """
+    if endpoint == "static":
+        return f"static/{valores['filename']}"
+    if endpoint == "index":
+        return "index.html"
+    if endpoint == "docker_details":
+        return f"docker/{valores['colecao']}.html"
+    if endpoint == "cve_list":
+        pasta = f"cve-list/{valores['colecao']}"
+        if valores.get("modelo"):
+            pasta += f"/modelo/{valores['modelo']}"
+        return f"{pasta}/{valores.get('page', 1)}.html"
+    if endpoint == "resumo":
+        return f"resumo/{valores['colecao']}/{valores['id']}.html"
+    return None
+
+
+def link_relativo(caminho: str) -> str:
+    """Monta o link de 'caminho' relativo à página em renderização.
+
+    Links relativos permitem abrir o site direto do disco (file://), sem servidor.
+    """
+    relativo = posixpath.relpath(caminho, posixpath.dirname(pagina_atual) or ".")
+    return quote(relativo)
+
+
+def url_for_estatico(endpoint: str, **valores) -> str:
+    """Substitui o 'url_for' dos templates durante a geração do site."""
+    caminho = caminho_pagina(endpoint, valores)
+    return link_relativo(caminho) if caminho else "#"
+
+
+def inicializar_processo(pasta_destino: str, usar_bootstrap_local: bool):
+    """Prepara o processo (principal ou de trabalho) para renderizar páginas estáticas.
+
+    Args:
+        pasta_destino: A raiz do site gerado.
+        usar_bootstrap_local: Se True, os templates apontam para a cópia local do Bootstrap.
+    """
+    global destino, bootstrap_local
+    destino = pasta_destino
+    bootstrap_local = usar_bootstrap_local
+    # 'site_estatico' oculta nos templates os recursos que dependem do servidor
+    app.jinja_env.globals.update(url_for=url_for_estatico, site_estatico=True)
+
+
+# ========== Gravação Dos Arquivos ========== #
+def gravar_arquivo(caminho: str, dados: bytes):
+    """Grava um arquivo do site de forma atômica.
+
+    O conteúdo vai para um arquivo temporário e só então substitui o antigo,
+    para que o Apache nunca sirva uma página pela metade durante a geração.
+    """
+    caminho_completo = os.path.join(destino, caminho)
+    os.makedirs(os.path.dirname(caminho_completo), exist_ok=True)
+    temporario = f"{caminho_completo}.{os.getpid()}.tmp"
+    with open(temporario, "wb") as arquivo:
+        arquivo.write(dados)
+    os.replace(temporario, caminho_completo)
+
+
+def renderizar(cliente, caminho: str, url: str, arquivos: list, **parametros):
+    """Renderiza uma rota do aplicativo e grava o resultado no site.
+
+    A rota é executada pelo cliente de testes do Flask, reaproveitando as
+    mesmas consultas e templates do site dinâmico.
+
+    Args:
+        cliente: O cliente de testes do Flask.
+        caminho: O caminho do arquivo, relativo à raiz do site.
+        url: A URL da rota no aplicativo.
+        arquivos: A lista de arquivos gerados, atualizada com 'caminho'.
+        **parametros: Os parâmetros da query string.
+
+    Returns:
+        A resposta da rota, ou None se ela não retornou 200.
+    """
+    global pagina_atual
+    pagina_atual = caminho
+    resposta = cliente.get(url, query_string=parametros)
+    if resposta.status_code != 200:
+        print(f"Ignorando {url} {parametros or ''}: status {resposta.status_code}", file=sys.stderr)
+        return None
+
+    dados = resposta.get_data()
+    if bootstrap_local and caminho.endswith(".html"):
+        dados = dados.replace(URL_BOOTSTRAP.encode(), link_relativo(BOOTSTRAP_LOCAL).encode())
+    gravar_arquivo(caminho, dados)
+    arquivos.append(caminho)
+    return resposta
+
+
+def gerar_imagem(colecao: str) -> tuple:
+    """Gera todas as páginas e arquivos JSON de uma imagem.
+
+    Executada em paralelo, uma imagem por processo de trabalho.
+
+    Args:
+        colecao: O nome da coleção da imagem.
+
+    Returns:
+        Uma tupla (coleção, versão gerada, lista de arquivos gerados).
+    """
+    # A versão é lida antes de renderizar: se a imagem mudar durante a geração, a próxima execução a refaz
+    versao, _ = versao_colecao(colecao)
+    cliente = app.test_client()
+    arquivos = []
+    url_colecao = quote(colecao)
+
+    # Análise da imagem
+    renderizar(cliente, f"docker/{colecao}.html", f"/docker/{url_colecao}", arquivos)
+    renderizar(cliente, f"api/v1/imagens/{colecao}.json", f"/api/v1/imagens/{url_colecao}", arquivos)
+
+    # Lista de CVEs: uma sequência de páginas por modelo, mais a lista padrão (sem modelo)
+    modelos = modelos_colecao(colecao)
+    for modelo in [None, *modelos]:
+        # Sem o parâmetro, a rota lista o primeiro modelo (como em cve_list)
+        modelo_listado = modelo or (modelos[0] if modelos else None)
+        query_cve = {"cve": {"$exists": True}}
+        if modelo_listado:
+            query_cve["modelo"] = modelo_listado
+        total_pages = max((db[colecao].count_documents(query_cve) + CVES_POR_PAGINA - 1) // CVES_POR_PAGINA, 1)
+        for page in range(1, total_pages + 1):
+            renderizar(
+                cliente,
+                caminho_pagina("cve_list", {"colecao": colecao, "modelo": modelo, "page": page}),
+                f"/cve-list/{url_colecao}",
+                arquivos,
+                page=page,
+                **({"modelo": modelo} if modelo else {}),
+            )
+
+    # Lista de CVEs da API (todos os modelos, como na rota sem o parâmetro 'modelo')
+    total_cves = db[colecao].count_documents({"cve.0": {"$exists": True}})
+    for page in range(1, max((total_cves + CVES_POR_PAGINA - 1) // CVES_POR_PAGINA, 1) + 1):
+        renderizar(
+            cliente,
+            f"api/v1/imagens/{colecao}/cves/pagina-{page}.json",
+            f"/api/v1/imagens/{url_colecao}/cves",
+            arquivos,
+            page=page,
+        )
+
+    # Relatório de cada CVE
+    for doc in db[colecao].find({"cve": {"$exists": True}}, {"_id": True}):
+        id = str(doc["_id"])
+        renderizar(cliente, f"resumo/{colecao}/{id}.html", f"/resumo/{url_colecao}/{id}", arquivos)
+        renderizar(cliente, f"api/v1/imagens/{colecao}/cves/{id}.json", f"/api/v1/imagens/{url_colecao}/cves/{id}", arquivos)
+
+    return colecao, versao, arquivos
+
+
+# ========== Manifesto E Limpeza ========== #
+def ler_manifesto() -> dict:
+    """Lê o manifesto da última geração; retorna um manifesto vazio se não houver."""
+    try:
+        with open(os.path.join(destino, MANIFESTO), encoding="utf-8") as arquivo:
+            return json.load(arquivo)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"colecoes": {}}
+
+
+def remover_arquivos(arquivos):
+    """Remove arquivos que não fazem mais parte do site, junto com as pastas que ficarem vazias."""
+    for caminho in arquivos:
+        caminho_completo = os.path.join(destino, caminho)
+        try:
+            os.remove(caminho_completo)
+        except FileNotFoundError:
+            continue
+        pasta = os.path.dirname(caminho_completo)
+        while pasta != destino and not os.listdir(pasta):
+            os.rmdir(pasta)
+            pasta = os.path.dirname(pasta)
+
+
+def gerar_site(args):
+    """Gera o site, refazendo apenas as imagens cuja varredura mudou desde a última geração."""
+    inicializar_processo(os.path.abspath(args.destino), bool(args.bootstrap))
+    os.makedirs(destino, exist_ok=True)
+
+    anteriores = ler_manifesto()["colecoes"]
+    colecoes = sorted(c for c in db.list_collection_names() if not c.startswith("_"))
+
+    # Uma imagem é refeita se a versão mudou ou se sua página foi apagada do disco
+    pendentes = [
+        colecao
+        for colecao in colecoes
+        if args.completo
+        or anteriores.get(colecao, {}).get("versao") != versao_colecao(colecao)[0]
+        or not os.path.exists(os.path.join(destino, caminho_pagina("docker_details", {"colecao": colecao})))
+    ]
+    print(f"{len(pendentes)} de {len(colecoes)} imagens para gerar")
+
+    atuais = {colecao: anteriores[colecao] for colecao in colecoes if colecao in anteriores}
+    if pendentes:
+        # 'spawn': cada processo abre a própria conexão com o MongoDB (o MongoClient não deve atravessar um fork)
+        with ProcessPoolExecutor(
+            max_workers=args.processos,
+            mp_context=get_context("spawn"),
+            initializer=inicializar_processo,
+            initargs=(destino, bool(args.bootstrap)),
+        ) as executor:
+            for colecao, versao, arquivos in executor.map(gerar_imagem, pendentes):
+                # Remove as páginas de CVEs que não existem mais na nova versão
+                remover_arquivos(set(atuais.get(colecao, {}).get("arquivos", [])) - set(arquivos))
+                atuais[colecao] = {"versao": versao, "arquivos": arquivos}
+                print(f"'{colecao}': {len(arquivos)} arquivos gerados")
+
+    # Imagens removidas do banco saem do site
+    for colecao in set(anteriores) - set(colecoes):
+        remover_arquivos(anteriores[colecao].get("arquivos", []))
+        print(f"'{colecao}': removida do site")
+
+    # Página inicial, lista de imagens da API e arquivos estáticos: sempre regravados (custo baixo)
+    cliente = app.test_client()
+    renderizar(cliente, "index.html", "/", [])
+    renderizar(cliente, "api/v1/imagens.json", "/api/v1/imagens", [])
+    shutil.copytree(PASTA_STATIC, os.path.join(destino, "static"), dirs_exist_ok=True)
+    if args.bootstrap:
+        shutil.copyfile(args.bootstrap, os.path.join(destino, BOOTSTRAP_LOCAL))
+
+    manifesto = {"gerado_em": datetime.now(timezone.utc).isoformat(), "colecoes": atuais}
+    gravar_arquivo(MANIFESTO, json.dumps(manifesto, ensure_ascii=False).encode("utf-8"))
+    print(f"Site gerado em {destino}")
+
+
+# ================================================== #
+# SEÇÃO 3: INÍCIO DO PROGRAMA
+# ================================================== #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Gera uma cópia estática (HTML e JSON) do site a partir das análises gravadas no MongoDB."
+    )
+    parser.add_argument("destino", nargs="?", default=DESTINO_PADRAO, help=f"Diretório do site (padrão: {DESTINO_PADRAO})")
+    parser.add_argument("-p", "--processos", type=int, default=os.cpu_count(), help="Imagens geradas ao mesmo tempo")
+    parser.add_argument("--completo", action="store_true", help="Refaz todas as imagens (ex: depois de alterar os templates)")
+    parser.add_argument("--bootstrap", help="Arquivo bootstrap.min.css local, para uso sem acesso à internet")
+
+    args = parser.parse_args()
+    if db is None:
+        sys.exit("Banco de dados não disponível: verifique a seção [DATABASE] do web_config.ini.")
+    gerar_site(args)